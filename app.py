@@ -1,8 +1,570 @@
+import collections
+import hashlib
+import heapq
 import os
+import queue
+import re
+import sqlite3
+import stat
 import sys
+import tempfile
+import threading
+import time
+from array import array
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext, ttk
 import tkinter.font as tkfont
+from concurrent.futures import ThreadPoolExecutor
+
+_TICK_RUN = re.compile("`+")
+
+def longest_backtick_run(content):
+    """
+    返回内容中最长连续反引号的长度
+    单遍扫描：find 直接定位下一段长于当前最长值的反引号 (更短的段由 C 层子串搜索整体跳过)，量出长度后从段尾继续
+    """
+    longest, pos, n = 0, 0, len(content)
+    while n - pos > longest:
+        hit = content.find("`" * (longest + 1), pos)
+        if hit == -1: break
+        pos = _TICK_RUN.match(content, hit).end()
+        longest = pos - hit
+    return longest
+
+# 引用块的语言标记：正文是内容相同的首个文件的相对路径，还原时复制该文件
+REF_LANG = "ref"
+
+class BlockDeduper:
+    """
+    "内容去重" 开启时使用：按代码块正文 (文件内容 + 闭合栅栏) 的哈希记住首次出现的路径，
+    之后内容相同的文件改为输出引用块；引用块不比原代码块短时 (如空文件) 仍输出原块
+    """
+
+    def __init__(self):
+        self.first = {}
+        self.files = 0
+
+    def apply(self, rel_path, block):
+        start = block.index("\n", block.index("\n") + 1) + 1
+        digest = hashlib.sha1(block[start:].encode("utf-8")).digest()
+        source = self.first.setdefault(digest, rel_path)
+        if source == rel_path:
+            return block
+        fence = "`" * max(3, longest_backtick_run(source) + 1)
+        ref = f"{fence}{REF_LANG}\n# {rel_path}\n{source}\n{fence}\n\n"
+        if len(ref) >= len(block):
+            return block
+        self.files += 1
+        return ref
+
+# 删除列表块的语言标记 (CLI 增量导出生成)：正文每行一个已删除的相对路径
+DELETE_LANG = "delete"
+
+# 二进制嗅探只看文件首块
+SNIFF_BYTES = 8192
+# 文本中不应大量出现的控制字符 (保留 \t \n \r \f \b 与 ESC)
+_CONTROL_BYTES = bytes(c for c in range(32) if c not in b"\t\n\r\f\b\x1b") + b"\x7f"
+
+def looks_binary(head):
+    """首块含 NUL，或控制字符占比超过 10% 时视为二进制"""
+    if b"\0" in head: return True
+    control = len(head) - len(head.translate(None, _CONTROL_BYTES))
+    return control * 10 > len(head)
+
+def read_source_bytes(full_path):
+    """文件只读取一次：首块疑似二进制时返回 None，不再读取剩余内容"""
+    with open(full_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+        if looks_binary(head): return None
+        return head + f.read()
+
+def decode_source_text(data):
+    """在内存中依次尝试 utf-8、gb18030，最后按 utf-8 忽略错误解码，并统一换行符"""
+    for encoding in ("utf-8", "gb18030"):
+        try:
+            content = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        content = data.decode("utf-8", errors="ignore")
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+class ExportStats:
+    """
+    "性能统计" 开启时的计时与计数：各阶段累计耗时、读取字节数、按原因统计的跳过文件、最慢的 N 个文件
+    阶段耗时为各线程的累计值，并发时之和可能超过总耗时
+    """
+    PHASES = ("walk", "cache", "read", "decode", "fence", "render", "dedup", "insert")
+
+    def __init__(self, top_n=10):
+        self.top_n = top_n
+        self.started = time.perf_counter()
+        self.phases = collections.Counter()
+        self.counters = collections.Counter()
+        self.skipped = collections.Counter()
+        self._slowest = []
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock: self.phases[phase] += seconds
+
+    def count(self, name, n=1):
+        with self._lock: self.counters[name] += n
+
+    def skip(self, reason):
+        with self._lock: self.skipped[reason] += 1
+
+    def file_done(self, rel_path, seconds):
+        with self._lock:
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, (seconds, rel_path))
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, (seconds, rel_path))
+
+    def timed_iter(self, phase, iterable):
+        """包装迭代器，把每次取下一项的耗时计入 phase"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(phase, time.perf_counter() - start)
+                return
+            self.add(phase, time.perf_counter() - start)
+            yield item
+
+    def summary(self):
+        lines = [f"总耗时 {time.perf_counter() - self.started:.3f}s"]
+        lines += [f"{name}: {self.phases[name]:.3f}s" for name in self.PHASES if name in self.phases]
+        lines += [f"{name}: {value}" for name, value in sorted(self.counters.items())]
+        if self.skipped:
+            lines.append("跳过: " + ", ".join(f"{reason} {n}" for reason, n in sorted(self.skipped.items())))
+        if self._slowest:
+            lines.append(f"最慢的 {len(self._slowest)} 个文件:")
+            lines += [f"  {seconds:.4f}s  {path}" for seconds, path in sorted(self._slowest, reverse=True)]
+        return "\n".join(lines)
+
+def default_cache_dir():
+    """用户缓存目录：Windows 用 %LOCALAPPDATA%，其余平台遵循 XDG_CACHE_HOME"""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "code_merger")
+
+class ExportCache:
+    """
+    提取缓存：以 (目标目录, 相对路径) 为键保存渲染好的代码块，size + mtime 一致即复用
+    关闭时按最近使用时间淘汰，使缓存总大小不超过 max_bytes
+    """
+    FORMAT = "gui-2"  # 渲染逻辑变化时递增，使旧条目失效
+
+    def __init__(self, cache_dir, root_path, max_bytes=512 * 1024 * 1024):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.root = os.path.abspath(root_path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._used = []
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "blocks.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blocks ("
+            " root TEXT, rel_path TEXT, fmt TEXT, size INTEGER, mtime_ns INTEGER,"
+            " digest TEXT, block TEXT, nbytes INTEGER, last_used REAL,"
+            " PRIMARY KEY (root, rel_path, fmt))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blocks_lru ON blocks (last_used)")
+        self._meta = {
+            rel_path: (rowid, size, mtime_ns)
+            for rowid, rel_path, size, mtime_ns in self._conn.execute(
+                "SELECT rowid, rel_path, size, mtime_ns FROM blocks WHERE root = ? AND fmt = ?",
+                (self.root, self.FORMAT),
+            )
+        }
+
+    def lookup(self, rel_path, st):
+        meta = self._meta.get(rel_path)
+        if meta is None or meta[1] != st.st_size or meta[2] != st.st_mtime_ns:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT block FROM blocks WHERE rowid = ?", (meta[0],)).fetchone()
+            if row is not None: self._used.append(meta[0])
+        return row[0] if row else None
+
+    def store(self, rel_path, st, block):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.root, rel_path, self.FORMAT, st.st_size, st.st_mtime_ns, None, block, len(block.encode("utf-8")), time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            now = time.time()
+            self._conn.executemany("UPDATE blocks SET last_used = ? WHERE rowid = ?", ((now, r) for r in self._used))
+            total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM blocks").fetchone()[0]
+            if total > self.max_bytes:
+                evict = []
+                for rowid, nbytes in self._conn.execute("SELECT rowid, nbytes FROM blocks ORDER BY last_used"):
+                    if total <= self.max_bytes: break
+                    evict.append((rowid,))
+                    total -= nbytes
+                self._conn.executemany("DELETE FROM blocks WHERE rowid = ?", evict)
+            self._conn.commit()
+            self._conn.close()
+
+class SelectionTree:
+    """
+    紧凑的三态勾选模型：每个已加载的路径分配一个整数 ID，各项状态存放在并列的数组里
+    - 勾选/取消某个节点时只在该节点上记录一个带时间戳的标记，后代通过祖先链上最新的标记得到有效状态，
+      不需要逐个修改后代
+    - 每个节点维护"单元数"（已加载文件及未展开/空目录各算 1 个）与已勾选单元数，
+      沿祖先链 O(depth) 更新，据此得到 全选/全不选/部分选中 三态
+    0 号节点是根目录，初始为全选
+    """
+    NONE, ALL, PARTIAL = 0, 1, 2
+
+    def __init__(self, root_path=None):
+        self.root_path = root_path
+        self.ids = {}                    # 路径 -> ID
+        self.paths = []                  # ID -> 路径
+        self.parent = array("l")         # ID -> 父节点 ID (根为 -1)
+        self.mark_epoch = array("q")     # 最近一次显式勾选/取消的时间戳 (-1 表示无)
+        self.mark_value = bytearray()    # 该次操作的取值
+        self.units = array("q")          # 子树单元数
+        self.selected = array("q")       # 子树已勾选单元数 (在 count_epoch 时刻有效)
+        self.count_epoch = array("q")
+        self._epoch = 0
+        self._new_node(root_path, -1, True)
+        self.mark_epoch[0] = 0
+        self.mark_value[0] = 1
+
+    def _new_node(self, path, parent, value):
+        node = len(self.paths)
+        self.paths.append(path)
+        self.ids[path] = node
+        self.parent.append(parent)
+        self.mark_epoch.append(-1)
+        self.mark_value.append(0)
+        self.units.append(1)
+        self.selected.append(1 if value else 0)
+        self.count_epoch.append(self._epoch)
+        return node
+
+    def _chain(self, node):
+        chain = []
+        while node != -1:
+            chain.append(node)
+            node = self.parent[node]
+        return chain
+
+    def _override_above(self, node):
+        """严格祖先中最新的标记 (时间戳, 取值)"""
+        best = (-1, 0)
+        node = self.parent[node]
+        while node != -1:
+            if self.mark_epoch[node] > best[0]:
+                best = (self.mark_epoch[node], self.mark_value[node])
+            node = self.parent[node]
+        return best
+
+    def _count(self, node):
+        epoch, value = self._override_above(node)
+        if self.count_epoch[node] >= epoch:
+            return self.selected[node]
+        # 计数早于祖先的最新标记：整棵子树都被该标记覆盖
+        return self.units[node] if value else 0
+
+    def _propagate(self, node, d_units, d_selected):
+        """把单元数/勾选数的变化沿祖先链向上累加，必要时先按祖先标记补齐过期的计数"""
+        chain = self._chain(node)[1:]
+        overrides = []
+        best = (-1, 0)
+        for ancestor in reversed(chain):
+            overrides.append(best)
+            if self.mark_epoch[ancestor] > best[0]:
+                best = (self.mark_epoch[ancestor], self.mark_value[ancestor])
+        overrides.reverse()
+        for ancestor, (epoch, value) in zip(chain, overrides):
+            if self.count_epoch[ancestor] < epoch:
+                self.selected[ancestor] = self.units[ancestor] if value else 0
+            self.units[ancestor] += d_units
+            self.selected[ancestor] += d_selected
+            self.count_epoch[ancestor] = self._epoch
+
+    def value(self, node):
+        """节点的有效勾选状态：自身及祖先中最新的标记"""
+        epoch, value = self.mark_epoch[node], self.mark_value[node]
+        above = self._override_above(node)
+        return bool(above[1] if above[0] > epoch else value)
+
+    def state(self, node):
+        selected = self._count(node)
+        if selected == 0: return self.NONE
+        if selected == self.units[node]: return self.ALL
+        return self.PARTIAL
+
+    def add_children(self, node, paths):
+        """展开目录时登记其子节点，子节点继承目录当前的有效状态"""
+        value = self.value(node)
+        ids = [self._new_node(path, node, value) for path in paths]
+        if ids:
+            old_units, old_selected = self.units[node], self._count(node)
+            self.units[node] = len(ids)
+            self.selected[node] = len(ids) if value else 0
+            self.count_epoch[node] = self._epoch
+            self._propagate(node, len(ids) - old_units, self.selected[node] - old_selected)
+        return ids
+
+    def set(self, node, value):
+        self._epoch += 1
+        old = self._count(node)
+        new = self.units[node] if value else 0
+        self.mark_epoch[node] = self._epoch
+        self.mark_value[node] = 1 if value else 0
+        self.selected[node] = new
+        self.count_epoch[node] = self._epoch
+        self._propagate(node, 0, new - old)
+
+    def is_selected(self, path):
+        """任意路径的勾选状态：尚未加载的路径继承最近一个已加载祖先目录的状态"""
+        while path not in self.ids:
+            parent = os.path.dirname(path)
+            if parent == path: return False
+            path = parent
+        return self.value(self.ids[path])
+
+    def is_pruned(self, path):
+        """目录下没有任何勾选项时返回 True，遍历时可整棵子树跳过"""
+        node = self.ids.get(path)
+        # 未加载的目录没有已加载的后代，状态完全继承自祖先
+        if node is None: return not self.is_selected(path)
+        return self.state(node) == self.NONE
+
+    def snapshot(self):
+        """复制一份供后台线程只读使用"""
+        snap = SelectionTree.__new__(SelectionTree)
+        snap.root_path = self.root_path
+        snap.ids = dict(self.ids)
+        snap.paths = list(self.paths)
+        for name in ("parent", "mark_epoch", "units", "selected", "count_epoch"):
+            setattr(snap, name, array(getattr(self, name).typecode, getattr(self, name)))
+        snap.mark_value = bytearray(self.mark_value)
+        snap._epoch = self._epoch
+        return snap
+
+# 忽略规则文件：每个目录下的 .gitignore / .ignore 作用于该目录子树，工程根目录的 .codemergerignore 作用于整个工程
+# 优先级 (与 ripgrep 一致)：深层目录的规则优先；同一目录内 .codemergerignore > .ignore > .gitignore
+IGNORE_FILE_NAMES = (".gitignore", ".ignore")
+PROJECT_IGNORE_FILE = ".codemergerignore"
+
+def _glob_to_regex(pattern):
+    """把 gitignore 通配符翻译为正则：* 与 ? 不跨越 /，** 匹配任意层级目录"""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**/", i):
+                out.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern.startswith("**", i):
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 2)
+            if j == -1:
+                out.append("\\[")
+            else:
+                body = pattern[i + 1:j].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j + 1
+                continue
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+def parse_ignore_line(line):
+    """解析一行忽略规则，返回 (正则, 是否取反, 是否仅匹配目录)；空行与注释返回 None"""
+    line = line.rstrip("\r\n")
+    if not line or line.startswith("#"):
+        return None
+    # 行尾空格忽略，除非用反斜杠转义
+    stripped = line.rstrip(" ")
+    if stripped != line and stripped.endswith("\\"):
+        stripped += " "
+    line = stripped
+    negate = line.startswith("!")
+    if negate or line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    # 含 / 的规则相对于忽略文件所在目录，否则匹配任意层级的同名项
+    anchored = "/" in line
+    regex = _glob_to_regex(line.lstrip("/"))
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return regex, negate, dir_only
+
+class IgnoreRules:
+    """
+    单个忽略文件编译后的规则
+    所有规则倒序拼接为一个正则的各个分支：re 按顺序尝试分支，首个完整匹配的分支就是最后一条生效的规则，
+    因此每个路径只需一次 fullmatch 即可得出结论
+    """
+    __slots__ = ("_dir_re", "_dir_negate", "_file_re", "_file_negate")
+
+    def __init__(self, rules):
+        self._dir_re, self._dir_negate = self._compile(rules)
+        self._file_re, self._file_negate = self._compile([r for r in rules if not r[2]])
+
+    @staticmethod
+    def _compile(rules):
+        if not rules:
+            return None, ()
+        rules = rules[::-1]
+        regex = re.compile("|".join(f"({r[0]})" for r in rules), re.DOTALL)
+        return regex, tuple(r[1] for r in rules)
+
+    def match(self, rel_path, is_dir):
+        """命中忽略规则返回 True，命中取反规则返回 False，未命中返回 None"""
+        regex, negate = (self._dir_re, self._dir_negate) if is_dir else (self._file_re, self._file_negate)
+        if regex is None:
+            return None
+        m = regex.fullmatch(rel_path)
+        if m is None:
+            return None
+        return not negate[m.lastindex - 1]
+
+def load_ignore_rules(path):
+    """读取并编译一个忽略文件，文件不存在或没有有效规则时返回 None"""
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            rules = [rule for rule in map(parse_ignore_line, f) if rule is not None]
+    except OSError:
+        return None
+    return IgnoreRules(rules) if rules else None
+
+def is_ignored(chain, rel_path, is_dir):
+    """按 (相对目录前缀, 规则) 链判断路径是否被忽略：链尾 (更深/优先级更高) 的规则先判断"""
+    for prefix, rules in reversed(chain):
+        result = rules.match(rel_path[len(prefix):], is_dir)
+        if result is not None:
+            return result
+    return False
+
+class IgnoreMatcher:
+    """
+    文件树加载与提取共用的忽略规则
+    树是按需逐层加载的：目录第一次被列出时才读取其中的忽略文件，并缓存从根到该目录的规则链
+    """
+
+    def __init__(self, root_path=None, enabled=True):
+        self.enabled = enabled and root_path is not None
+        self._root = os.path.normpath(root_path) if root_path else ""
+        self._chains = {}
+
+    def _rel(self, full_path):
+        rel = os.path.relpath(full_path, self._root)
+        return rel.replace(os.sep, "/") if os.sep != "/" else rel
+
+    def _chain(self, dir_path, names):
+        key = os.path.normpath(dir_path)
+        chain = self._chains.get(key)
+        if chain is None:
+            if key == self._root:
+                chain, rel_prefix = (), ""
+                file_names = IGNORE_FILE_NAMES + (PROJECT_IGNORE_FILE,)
+            else:
+                chain, rel_prefix = self._chains.get(os.path.dirname(key), ()), self._rel(key) + "/"
+                file_names = IGNORE_FILE_NAMES
+            for name in file_names:
+                if name in names:
+                    rules = load_ignore_rules(os.path.join(key, name))
+                    if rules is not None: chain = chain + ((rel_prefix, rules),)
+            self._chains[key] = chain
+        return chain
+
+    def filter(self, dir_path, entries):
+        """过滤 DirIndex 列出的子项，去掉被忽略的文件与目录；被忽略的目录之后也就不会再被列出"""
+        if not self.enabled: return entries
+        chain = self._chain(dir_path, {entry[0] for entry in entries})
+        if not chain: return entries
+        rel_prefix = self._rel(dir_path) + "/" if os.path.normpath(dir_path) != self._root else ""
+        kept = []
+        for entry in entries:
+            if not is_ignored(chain, rel_prefix + entry[0], entry[2]): kept.append(entry)
+        return kept
+
+class DirIndex:
+    """
+    已列出目录的内存索引：目录路径 -> (目录 mtime, 子项元组)
+    子项为 (名称, 完整路径, 是否目录, 是否符号链接, 大小, mtime)
+    再次访问时只 stat 目录本身，mtime 未变就直接复用上次的列表；文件树加载与提取共用同一份索引
+    注意：原地修改文件不会改变目录 mtime，因此这里的大小只用于进度显示，缓存校验仍以实时 stat 为准
+    """
+    # mtime 距今不足该值 (纳秒) 的目录不入索引，避免同一时间粒度内的后续修改被漏掉
+    RACY_NS = 2 * 10 ** 9
+
+    def __init__(self):
+        self._dirs = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._dirs.clear()
+
+    def list(self, path):
+        """返回目录的子项元组，无法读取时返回 None"""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._dirs.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        entries = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    size = entry_mtime = 0
+                    if not is_dir:
+                        try:
+                            st = entry.stat()
+                            size, entry_mtime = st.st_size, st.st_mtime_ns
+                        except OSError:
+                            pass
+                    entries.append((entry.name, entry.path, is_dir, entry.is_symlink(), size, entry_mtime))
+        except OSError:
+            return None
+        entries = tuple(entries)
+        if int(time.time() * 1e9) - mtime > self.RACY_NS:
+            with self._lock:
+                self._dirs[path] = (mtime, entries)
+        return entries
 
 class CodeMergerApp:
     def __init__(self, root):
@@ -13,6 +575,8 @@ class CodeMergerApp:
         # 忽略的目录和文件
         self.IGNORE_DIRS = {'.git', '__pycache__', '.idea', '.vscode', 'venv', 'env', 'node_modules', 'build', 'dist', 'target'}
         self.IGNORE_FILES = {'.DS_Store', 'Thumbs.db'}
+        # 提取时并发读取文件的线程数 (输出顺序不受影响)
+        self.READ_JOBS = min(16, (os.cpu_count() or 1) * 4)
 
         # 定义默认支持的文件类型选项
         self.TYPE_OPTIONS = {
@@ -30,8 +594,12 @@ class CodeMergerApp:
         self.check_vars = {} 
         
         # 存储文件树的状态
-        self.tree_selection = {}  # Path -> Boolean
-        self.tree_item_map = {}   # Item ID -> Path
+        self.selection = SelectionTree()  # 三态勾选模型，目录树按需（展开时）加载
+        self.dir_index = DirIndex()       # 目录列表索引，加载与提取共用
+        self.ignore = IgnoreMatcher()     # .gitignore 等忽略规则，加载与提取共用
+        self._export_job = None   # 正在进行的后台提取任务
+        self._watch = None        # "监视变化" 的后台轮询状态
+        self._last_watch_job = None  # 最近一次可监视的提取任务 (含文件快照)
         
         self.setup_icons()
 
@@ -88,6 +656,12 @@ class CodeMergerApp:
         for x, y in [(3,8), (4,9), (5,10), (6,9), (7,8), (8,7), (9,6), (10,5), (11,4)]:
              self.img_checked.put(("#FFFFFF",), to=(x, y, x+2, y+2))
 
+        # 部分选中 (框内实心方块)
+        self.img_partial = tk.PhotoImage(width=size, height=size)
+        self.img_partial.put(("#888888",), to=(0, 0, size, size))
+        self.img_partial.put(("#FFFFFF",), to=(1, 1, size-1, size-1))
+        self.img_partial.put(("#4CAF50",), to=(4, 4, size-4, size-4))
+
     def setup_ui(self):
         # ================= Top Frame =================
         top_frame = tk.Frame(self.root, pady=10, padx=10)
@@ -106,9 +680,9 @@ class CodeMergerApp:
 
         tk.Frame(top_frame, width=20).pack(side=tk.LEFT)
 
-        btn_run = tk.Button(top_frame, text="提取: 生成 Markdown", command=self.generate_content, 
-                            bg="#4CAF50", fg="white", font=("Arial", 10, "bold"))
-        btn_run.pack(side=tk.LEFT, padx=5)
+        self.btn_run = tk.Button(top_frame, text="提取: 生成 Markdown", command=self.generate_content, 
+                                 bg="#4CAF50", fg="white", font=("Arial", 10, "bold"))
+        self.btn_run.pack(side=tk.LEFT, padx=5)
 
         btn_restore = tk.Button(top_frame, text="还原: 写入文件", command=self.restore_project, 
                                 bg="#FF5722", fg="white", font=("Arial", 10, "bold"))
@@ -126,6 +700,10 @@ class CodeMergerApp:
         left_top_box = tk.Frame(left_frame)
         left_top_box.pack(side=tk.TOP, fill=tk.X, padx=5, pady=2)
         tk.Label(left_top_box, text="文件选择树", font=("Arial", 10, "bold")).pack(side=tk.LEFT)
+        # 遵循 .gitignore / .ignore / .codemergerignore：被忽略的目录不会出现在树中，也不会被遍历
+        self.use_ignore_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(left_top_box, text="遵循 .gitignore", variable=self.use_ignore_var,
+                       command=self.load_tree_from_entry).pack(side=tk.RIGHT)
         
         # --- 新增：树操作按钮 (全选/全不选) ---
         btn_box = tk.Frame(left_frame, pady=2)
@@ -146,6 +724,7 @@ class CodeMergerApp:
         self.tree.configure(xscrollcommand=xsb.set)
 
         self.tree.bind("<Button-1>", self.on_tree_click)
+        self.tree.bind("<<TreeviewOpen>>", self.on_tree_open)
 
         # --- Right Side: Content & Filters ---
         right_frame = tk.Frame(self.paned_window)
@@ -175,6 +754,26 @@ class CodeMergerApp:
         tk.Label(custom_frame, text="额外后缀: ").pack(side=tk.LEFT)
         self.custom_ext_entry = tk.Entry(custom_frame, width=30)
         self.custom_ext_entry.pack(side=tk.LEFT, padx=5)
+        # 提取缓存：未修改的文件直接复用上次渲染结果
+        self.use_cache_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(custom_frame, text="启用提取缓存", variable=self.use_cache_var).pack(side=tk.LEFT, padx=10)
+        # 性能统计：记录各阶段耗时，提取结束后弹窗显示
+        self.show_stats_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(custom_frame, text="性能统计", variable=self.show_stats_var).pack(side=tk.LEFT)
+        # 内容去重：内容相同的文件只输出一次，之后的副本输出为引用块
+        self.dedup_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(custom_frame, text="内容去重", variable=self.dedup_var).pack(side=tk.LEFT, padx=10)
+        # 监视变化：提取完成后定期检查源文件，只替换内容变化的代码块
+        self.watch_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(custom_frame, text="监视变化", variable=self.watch_var,
+                       command=self.toggle_watch).pack(side=tk.LEFT)
+        # 大小上限：按文件大小提前跳过，留空表示不限
+        tk.Label(custom_frame, text="单文件上限(KB): ").pack(side=tk.LEFT)
+        self.max_file_entry = tk.Entry(custom_frame, width=8)
+        self.max_file_entry.pack(side=tk.LEFT, padx=5)
+        tk.Label(custom_frame, text="总量上限(MB): ").pack(side=tk.LEFT)
+        self.max_total_entry = tk.Entry(custom_frame, width=8)
+        self.max_total_entry.pack(side=tk.LEFT, padx=5)
 
         # 2. Text Area
         text_frame = tk.Frame(right_frame, padx=5, pady=5)
@@ -186,7 +785,8 @@ class CodeMergerApp:
 
         self.text_area = scrolledtext.ScrolledText(text_frame, font=code_font, undo=True)
         self.text_area.pack(fill=tk.BOTH, expand=True)
-        self.text_area.bind('<KeyRelease>', self.update_stats)
+        self._install_text_proxy()
+        self.text_area.bind('<<Modified>>', self._on_text_modified)
 
         # 3. Bottom Buttons
         bottom_frame = tk.Frame(right_frame, pady=5)
@@ -217,6 +817,14 @@ class CodeMergerApp:
         self.stats_label = tk.Label(self.status_frame, text="Ready", anchor=tk.W, font=("Arial", 9))
         self.stats_label.pack(side=tk.LEFT, padx=10)
 
+        # 提取进度 (后台线程提取，界面分批插入)
+        self.btn_cancel = tk.Button(self.status_frame, text="取消", command=self.cancel_export, state=tk.DISABLED)
+        self.btn_cancel.pack(side=tk.RIGHT, padx=5)
+        self.progress = ttk.Progressbar(self.status_frame, length=200, mode="determinate")
+        self.progress.pack(side=tk.RIGHT, padx=5)
+        self.progress_label = tk.Label(self.status_frame, text="", anchor=tk.E, font=("Arial", 9))
+        self.progress_label.pack(side=tk.RIGHT, padx=5)
+
         # Initial Text
         welcome_msg = """ # 使用说明:
  # 1. [选择文件夹]: 左侧会自动加载目录树，默认全部勾选。
@@ -241,65 +849,89 @@ class CodeMergerApp:
             self.refresh_tree(folder_selected)
 
     def refresh_tree(self, root_path):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        self.tree_selection.clear()
-        self.tree_item_map.clear()
-        self._populate_node("", root_path)
-
-    def _populate_node(self, parent_item, current_path):
-        try:
-            items = os.listdir(current_path)
-            items.sort(key=lambda x: (not os.path.isdir(os.path.join(current_path, x)), x.lower()))
-        except PermissionError:
-            return
-
-        for name in items:
-            if name in self.IGNORE_DIRS or name in self.IGNORE_FILES:
-                continue
-                
-            full_path = os.path.join(current_path, name)
-            is_dir = os.path.isdir(full_path)
-            
-            self.tree_selection[full_path] = True
-            
+        self.tree.delete(*self.tree.get_children())
+        self.selection = SelectionTree(root_path)
+        self.ignore = IgnoreMatcher(root_path, self.use_ignore_var.get())
+        self.dir_index.clear()
+        self._populate_node(0)
+
+    def _populate_node(self, node):
+        """
+        只加载一层子节点：子目录先挂一个占位子节点以显示展开箭头，展开时再加载
+        Treeview 的 item ID 直接使用勾选模型中的节点 ID
+        """
+        current_path = self.selection.paths[node]
+        entries = self.dir_index.list(current_path)
+        if entries is None: return
+        entries = self.ignore.filter(current_path, entries)
+        items = [(name, full_path, is_dir) for name, full_path, is_dir, _, _, _ in entries
+                 if name not in self.IGNORE_DIRS and name not in self.IGNORE_FILES]
+        items.sort(key=lambda x: (not x[2], x[0].lower()))
+
+        children = self.selection.add_children(node, [full_path for _, full_path, _ in items])
+        img = self.img_checked if self.selection.value(node) else self.img_unchecked
+        parent_item = "" if node == 0 else str(node)
+        for (name, full_path, is_dir), child in zip(items, children):
             item_id = self.tree.insert(
-                parent_item, "end", text=f" {name}", open=False, image=self.img_checked
+                parent_item, "end", iid=str(child), text=f" {name}", open=False, image=img
             )
-            self.tree_item_map[item_id] = full_path
-
             if is_dir:
-                self._populate_node(item_id, full_path)
+                self.tree.insert(item_id, "end", iid=f"ph{child}", text="")
+
+    def on_tree_open(self, event=None):
+        item_id = self.tree.focus()
+        if not item_id.isdigit(): return
+        if self.tree.get_children(item_id) == (f"ph{item_id}",):
+            self.tree.delete(f"ph{item_id}")
+            self._populate_node(int(item_id))
+        # 折叠期间的勾选变化没有同步到子行图标，展开时补上
+        self._refresh_images(item_id, force_children=True)
+
+    def is_selected(self, path, selection=None):
+        """
+        判断路径是否被勾选：尚未加载的节点继承最近一个已加载祖先目录的状态
+        selection 为后台线程使用的勾选状态快照
+        """
+        return (selection or self.selection).is_selected(path)
+
+    def _image_for(self, node):
+        state = self.selection.state(node)
+        if state == SelectionTree.ALL: return self.img_checked
+        if state == SelectionTree.NONE: return self.img_unchecked
+        return self.img_partial
+
+    def _refresh_images(self, item_id, force_children=False):
+        """只更新可见行（自身及已展开目录下的行）的图标"""
+        if item_id:
+            self.tree.item(item_id, image=self._image_for(int(item_id)))
+        if item_id and not force_children and not self.tree.tk.getboolean(self.tree.item(item_id, "open")):
+            return
+        for child in self.tree.get_children(item_id):
+            if child.isdigit():
+                self._refresh_images(child)
 
     def on_tree_click(self, event):
         item_id = self.tree.identify_row(event.y)
-        if not item_id: return
-        full_path = self.tree_item_map.get(item_id)
-        if full_path:
-            current_state = self.tree_selection.get(full_path, True)
-            self.toggle_node(item_id, not current_state)
+        if not item_id or not item_id.isdigit(): return
+        # 点击展开箭头只负责展开/折叠，不改变勾选状态
+        if "indicator" in self.tree.identify_element(event.x, event.y): return
+        state = self.selection.state(int(item_id))
+        # 全选 -> 全不选；全不选或部分选中 -> 全选
+        self.toggle_node(item_id, state != SelectionTree.ALL)
 
     def toggle_node(self, item_id, state):
-        full_path = self.tree_item_map.get(item_id)
-        if full_path:
-            self.tree_selection[full_path] = state
-        img = self.img_checked if state else self.img_unchecked
-        self.tree.item(item_id, image=img)
-        for child in self.tree.get_children(item_id):
-            self.toggle_node(child, state)
+        self.selection.set(int(item_id), state)
+        self._refresh_images(item_id)
+        parent = self.tree.parent(item_id)
+        while parent:
+            self.tree.item(parent, image=self._image_for(int(parent)))
+            parent = self.tree.parent(parent)
 
     # --- 新增：批量修改选择状态 ---
     def batch_change_selection(self, state):
-        """一次性修改所有节点的状态"""
-        img = self.img_checked if state else self.img_unchecked
-        
-        # 更新数据
-        for path in self.tree_selection.keys():
-            self.tree_selection[path] = state
-            
-        # 更新视图 (直接遍历 item_map 最快)
-        for item_id in self.tree_item_map.keys():
-            self.tree.item(item_id, image=img)
+        """一次性修改所有节点的状态：只需在根节点上记一个标记，再刷新可见行"""
+        self.selection.set(0, state)
+        self._refresh_images("")
 
     # ================= Import / Export =================
 
@@ -349,95 +981,424 @@ class CodeMergerApp:
                     allowed.add(p)
         return tuple(allowed)
 
+    @staticmethod
+    def get_size_limit(entry, unit):
+        """读取大小上限输入框，留空或无效时返回 0 (不限)"""
+        try:
+            return max(0, int(float(entry.get().strip()) * unit))
+        except ValueError:
+            return 0
+
     def generate_content(self):
+        if self._export_job is not None: return
+        self.stop_watch()
         target_path = self.path_entry.get().strip()
         if not target_path or not os.path.isdir(target_path):
             messagebox.showerror("错误", "无效的文件夹路径")
             return
 
-        tree_text = "## Project Structure\n```text\n" + self.get_filtered_tree_text(target_path) + "\n```\n\n"
-        code_text = "## Code Contents\n\n" + self.get_filtered_file_content(target_path)
-        
-        self.text_area.delete(1.0, tk.END)
-        self.text_area.insert(tk.END, tree_text + code_text)
-        self.update_stats()
-
-    def get_filtered_tree_text(self, root_path):
-        output = []
-        base_level = root_path.count(os.sep)
-        for root, dirs, files in os.walk(root_path):
-            # 修正点：只过滤忽略名单，不要因为父目录未选中就阻止遍历子目录
-            dirs[:] = [d for d in dirs if d not in self.IGNORE_DIRS]
-            
-            # 计算层级
-            level = root.count(os.sep) - base_level
-            indent = "    " * level
-            folder_name = os.path.basename(root)
-            
-            # 显示逻辑：如果是根目录，或者该目录被显式选中，则打印目录行
-            # (如果目录没选但子文件选了，目录行不显示，只显示缩进后的文件名，这样保持了逻辑一致性)
-            if root == root_path or self.tree_selection.get(root, False):
-                if level == 0: output.append(f"{folder_name}/")
-                else: output.append(f"{indent}|-- {folder_name}/")
-            
-            sub_indent = "    " * (level + 1)
-            for f in files:
-                if f in self.IGNORE_FILES: continue
-                # 只要文件被选中，就添加到树结构中
-                if self.tree_selection.get(os.path.join(root, f), False):
-                    output.append(f"{sub_indent}|-- {f}")
-        return "\n".join(output)
-
-
-    def get_filtered_file_content(self, root_path):
-        output = []
+        # Tk 变量与勾选状态只能在主线程读取：先做快照再交给后台线程
         allowed_extensions = self.get_allowed_extensions()
+        selection = self.selection.snapshot()
+        ignore = self.ignore
+        use_cache = self.use_cache_var.get()
+        limits = (self.get_size_limit(self.max_file_entry, 1024), self.get_size_limit(self.max_total_entry, 1024 * 1024))
+
+        job = {
+            "queue": queue.Queue(maxsize=512), "cancel": threading.Event(),
+            "files_total": 0, "bytes_total": 0, "files_done": 0, "bytes_done": 0,
+            "written": 0, "skipped": 0, "error": None,
+            "stats": ExportStats() if self.show_stats_var.get() else None,
+            # 监视所需的快照：按输出顺序的 [完整路径, 相对路径, (size, mtime), 是否输出了代码块] 与目录 mtime
+            "watch": {"files": [], "dirs": {}, "root": target_path, "dedup": self.dedup_var.get()}
+                     if self.watch_var.get() else None,
+            "marks": [],
+        }
+        self._export_job = job
 
-        for root, dirs, files in os.walk(root_path):
-            # 修正点1：只过滤系统忽略的文件夹 (如 .git)，不再过滤未选中的文件夹
-            dirs[:] = [d for d in dirs if d not in self.IGNORE_DIRS]
-            
-            # 修正点2：删除了原先 "如果 root 没选中则 continue" 的代码
-            # 这样即使父目录没勾选，os.walk 依然会进入里面检查文件
-                
-            for file in files:
-                full_path = os.path.join(root, file)
-                
-                # 核心判断：直接判断具体文件是否被勾选
-                if not self.tree_selection.get(full_path, False): continue
-                    
-                if file.lower().endswith(allowed_extensions):
-                    rel_path = os.path.relpath(full_path, root_path).replace("\\", "/")
-                    try:
-                        content = ""
+        # 代码块追加在末尾；目录树在遍历结束后插入到顶部的 cm_tree 标记处
+        self.text_area.configure(undo=False)
+        self.text_area.delete(1.0, tk.END)
+        self.text_area.insert(tk.END, "## Code Contents\n\n")
+        self.text_area.mark_set("cm_tree", "1.0")
+        self.text_area.mark_gravity("cm_tree", tk.LEFT)
+        self.text_area.configure(state=tk.DISABLED)
+        self.btn_run.configure(state=tk.DISABLED)
+        self.btn_cancel.configure(state=tk.NORMAL)
+        self.progress.configure(value=0, maximum=1)
+
+        threading.Thread(target=self._export_worker,
+                         args=(job, target_path, allowed_extensions, selection, use_cache, limits, ignore,
+                               self.dedup_var.get()),
+                         daemon=True).start()
+        self.root.after(1, self._poll_export_queue)
+
+    def cancel_export(self):
+        if self._export_job is not None:
+            self._export_job["cancel"].set()
+            self.progress_label.config(text="正在取消...")
+
+    def _export_worker(self, job, target_path, allowed_extensions, selection, use_cache, limits=(0, 0), ignore=None,
+                       dedup=False):
+        """
+        后台线程：遍历、读取并渲染代码块，按顺序通过队列交给界面线程
+        limits 为 (单文件上限, 总量上限) 字节数，0 表示不限；超限文件不读取内容直接跳过
+        dedup 为 True 时按输出顺序去重，内容相同的后续文件输出为引用块
+        """
+        max_file_size, max_total_size = limits
+        total_size = 0
+        q, cancel, stats = job["queue"], job["cancel"], job["stats"]
+        cache = None
+        try:
+            if use_cache:
+                try:
+                    cache = ExportCache(default_cache_dir(), target_path)
+                except (OSError, sqlite3.Error):
+                    cache = None
+            output = []
+            window = self.READ_JOBS * 4
+            pending = collections.deque()
+            deduper = BlockDeduper() if dedup else None
+            watch = job["watch"]
+
+            def emit(size, rel_path, block, watch_item):
+                if deduper is not None and block is not None:
+                    if stats is not None:
+                        t0 = time.perf_counter()
+                    block = deduper.apply(rel_path, block)
+                    if stats is not None:
+                        stats.add("dedup", time.perf_counter() - t0)
+                if watch_item is not None:
+                    watch_item[3] = block is not None
+                q.put(("block", block, size, rel_path))
+
+            files = self.iter_filtered_files(target_path, allowed_extensions, selection, output, ignore=ignore,
+                                             visited=watch["dirs"] if watch is not None else None)
+            render = self._render_file_block
+            if stats is not None:
+                files = stats.timed_iter("walk", files)
+                render = lambda full_path, rel_path, cache: self._render_file_block_timed(full_path, rel_path, cache, stats)
+            with ThreadPoolExecutor(max_workers=self.READ_JOBS) as pool:
+                for full_path, rel_path, size in files:
+                    if cancel.is_set(): break
+                    snapshot = None
+                    if watch is not None or max_file_size or max_total_size:
+                        # 先 stat 再读取：读取期间的修改会在下一轮检查中被发现；
+                        # DirIndex 中的大小只用于进度显示 (原地修改不改变目录 mtime，可能已过期)，大小上限以实际 stat 为准
                         try:
-                            with open(full_path, "r", encoding="utf-8") as f: content = f.read()
-                        except UnicodeDecodeError:
-                            try:
-                                with open(full_path, "r", encoding="gb18030") as f: content = f.read()
-                            except:
-                                with open(full_path, "r", encoding="utf-8", errors="ignore") as f: content = f.read()
-
-                        max_backticks = 0
-                        import re
-                        ticks = re.findall(r'`+', content)
-                        if ticks: max_backticks = max(len(t) for t in ticks)
-                        fence = "`" * max(3, max_backticks + 1)
-                        
-                        ext = os.path.splitext(file)[1].lower().replace('.', '')
-                        lang = "python" if ext == "py" else ext
-                        if not lang: lang = "text"
-
-                        output.append(f"{fence}{lang}\n# {rel_path}\n{content}\n{fence}\n\n")
-                    except Exception as e:
-                        output.append(f"```text\n# Error: {e}\n```\n\n")
-        return "".join(output) if output else "## No files selected.\n"
+                            st = os.stat(full_path)
+                            snapshot = (st.st_size, st.st_mtime_ns)
+                            size = st.st_size
+                        except OSError:
+                            pass
+                    watch_item = None
+                    if watch is not None:
+                        watch_item = [full_path, rel_path, snapshot, False]
+                        watch["files"].append(watch_item)
+                    if (max_file_size and size > max_file_size) or (max_total_size and total_size + size > max_total_size):
+                        q.put(("skip",))
+                        if stats is not None:
+                            stats.skip("max_file_size" if max_file_size and size > max_file_size else "max_total_size")
+                        continue
+                    total_size += size
+                    q.put(("found", size))
+                    pending.append((size, rel_path, pool.submit(render, full_path, rel_path, cache), watch_item))
+                    # 按提交顺序取结果：输出顺序与文件顺序一致，在途任务数有上限
+                    while len(pending) >= window:
+                        size, rel_path, future, watch_item = pending.popleft()
+                        emit(size, rel_path, future.result(), watch_item)
+                while pending and not cancel.is_set():
+                    size, rel_path, future, watch_item = pending.popleft()
+                    emit(size, rel_path, future.result(), watch_item)
+                for _, _, future, _ in pending: future.cancel()
+            if not cancel.is_set():
+                q.put(("tree", "\n".join(output)))
+        except Exception as e:
+            q.put(("error", str(e)))
+        finally:
+            if cache is not None: cache.close()
+            q.put(("done", cancel.is_set()))
+
+    def _poll_export_queue(self):
+        """界面线程：批量取出代码块一次性插入文本框，每轮限时，保证界面可响应"""
+        job = self._export_job
+        batch, batch_chars, finished = [], 0, None
+        deadline = time.perf_counter() + 0.03
+        while time.perf_counter() < deadline and batch_chars < 512 * 1024:
+            try:
+                msg = job["queue"].get_nowait()
+            except queue.Empty:
+                break
+            kind = msg[0]
+            if kind == "found":
+                job["files_total"] += 1
+                job["bytes_total"] += msg[1]
+            elif kind == "block":
+                if msg[1] is None:
+                    job["skipped"] += 1
+                else:
+                    batch.append(msg[1])
+                    job["marks"].append(msg[3])
+                    batch_chars += len(msg[1])
+                    job["written"] += 1
+                job["files_done"] += 1
+                job["bytes_done"] += msg[2]
+            elif kind == "tree":
+                self.text_area.configure(state=tk.NORMAL)
+                self.text_area.insert("cm_tree", "## Project Structure\n```text\n" + msg[1] + "\n```\n\n")
+                self.text_area.configure(state=tk.DISABLED)
+            elif kind == "skip":
+                job["skipped"] += 1
+            elif kind == "error":
+                job["error"] = msg[1]
+            elif kind == "done":
+                finished = msg
+                break
+
+        if batch:
+            insert_start = time.perf_counter()
+            self.text_area.configure(state=tk.NORMAL)
+            line = int(self.text_area.index("end-1c").split(".")[0])
+            self.text_area.insert(tk.END, "".join(batch))
+            if job["watch"] is not None:
+                # 每个代码块都从行首开始：按行号给各块起点打标记，监视时据此原位替换
+                for i, block in enumerate(batch, len(job["marks"]) - len(batch)):
+                    self.text_area.mark_set(f"cm_block{i}", f"{line}.0")
+                    line += block.count("\n")
+            self.text_area.configure(state=tk.DISABLED)
+            if job["stats"] is not None:
+                job["stats"].add("insert", time.perf_counter() - insert_start)
+
+        self.progress.configure(maximum=max(job["files_total"], 1), value=job["files_done"])
+        skipped = f" | 跳过 {job['skipped']} 个" if job["skipped"] else ""
+        self.progress_label.config(text=f"{job['files_done']}/{job['files_total']} 个文件 | "
+                                        f"{job['bytes_done'] / 1048576:.1f}/{job['bytes_total'] / 1048576:.1f} MB{skipped}")
+
+        if finished is not None:
+            self._finish_export(job, cancelled=finished[1])
+        else:
+            self.root.after(1 if batch else 30, self._poll_export_queue)
+
+    def _finish_export(self, job, cancelled):
+        self._export_job = None
+        self.text_area.configure(state=tk.NORMAL)
+        if not cancelled and job["written"] == 0:
+            self.text_area.insert(tk.END, "## No files selected.\n")
+        self.text_area.configure(undo=True)
+        self.text_area.edit_reset()
+        self.btn_run.configure(state=tk.NORMAL)
+        self.btn_cancel.configure(state=tk.DISABLED)
+        if cancelled:
+            self.progress_label.config(text="已取消")
+        self.update_stats()
+        if job["error"]:
+            messagebox.showerror("错误", f"提取失败: {job['error']}")
+        elif job["stats"] is not None:
+            job["stats"].count("files", job["written"])
+            messagebox.showinfo("性能统计", job["stats"].summary())
+        if job["watch"] is not None and not cancelled and not job["error"]:
+            self._last_watch_job = job
+            self.start_watch()
+
+    # ================= Watch =================
+    # "监视变化"：后台线程定期比较 stat 快照 (与 Tk 一样跨平台，不依赖 inotify)；
+    # 文件内容变化时只重新渲染该文件，并按 cm_block 标记原位替换文本框中的代码块；
+    # 目录结构变化、跳过状态改变或开启了去重时，重新提取 (目录索引与提取缓存使其只读取变化的部分)
+
+    WATCH_INTERVAL = 1.0
+
+    def toggle_watch(self):
+        if not self.watch_var.get():
+            self.stop_watch()
+        elif self._last_watch_job is not None:
+            self.start_watch()
+        else:
+            self.progress_label.config(text="监视将在下次提取完成后开始")
+
+    def start_watch(self):
+        job = self._last_watch_job
+        if job is None or self._watch is not None or not self.watch_var.get(): return
+        watch = {"queue": queue.Queue(), "stop": threading.Event(), "job": job,
+                 "index": {item[1]: i for i, item in enumerate(m for m in job["watch"]["files"] if m[3])}}
+        self._watch = watch
+        threading.Thread(target=self._watch_worker, args=(watch,), daemon=True).start()
+        self.root.after(200, self._poll_watch_queue)
+        self.progress_label.config(text="正在监视变化...")
+
+    def stop_watch(self):
+        if self._watch is not None:
+            self._watch["stop"].set()
+            self._watch = None
+
+    def _watch_worker(self, watch):
+        """后台线程：检查目录与文件快照，有变化时渲染新代码块交给界面线程"""
+        q, state = watch["queue"], watch["job"]["watch"]
+        while not watch["stop"].wait(self.WATCH_INTERVAL):
+            for dir_path, mtime in state["dirs"].items():
+                try:
+                    if os.stat(dir_path).st_mtime_ns != mtime:
+                        q.put(("rescan",)); return
+                except OSError:
+                    q.put(("rescan",)); return
+            for item in state["files"]:
+                full_path, rel_path, snapshot, has_block = item
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    q.put(("rescan",)); return
+                if (st.st_size, st.st_mtime_ns) == snapshot: continue
+                if not has_block or state["dedup"]:
+                    q.put(("rescan",)); return
+                item[2] = (st.st_size, st.st_mtime_ns)
+                block = self._render_file_block(full_path, rel_path)
+                if block is None:
+                    q.put(("rescan",)); return
+                q.put(("update", rel_path, block))
+
+    def _poll_watch_queue(self):
+        watch = self._watch
+        if watch is None: return
+        updated = 0
+        while True:
+            try:
+                msg = watch["queue"].get_nowait()
+            except queue.Empty:
+                break
+            if msg[0] == "rescan":
+                self.stop_watch()
+                self.generate_content()
+                return
+            self._replace_block(watch, msg[1], msg[2])
+            updated += 1
+        if updated:
+            self.update_stats()
+            self.progress_label.config(text=f"正在监视变化... 已更新 {updated} 个代码块 ({time.strftime('%H:%M:%S')})")
+        self.root.after(200, self._poll_watch_queue)
+
+    def _replace_block(self, watch, rel_path, block):
+        """按标记原位替换一个代码块：删除 [本块起点, 下一块起点) 后插入新内容"""
+        i = watch["index"][rel_path]
+        mark = f"cm_block{i}"
+        start = self.text_area.index(mark)
+        end = self.text_area.index(f"cm_block{i + 1}") if i + 1 < len(watch["index"]) else self.text_area.index("end-1c")
+        self.text_area.delete(start, end)
+        self.text_area.insert(start, block)
+        # 标记默认随插入点右移：起点标记复位，下一块的标记正好落在新内容之后
+        self.text_area.mark_set(mark, start)
+
+    def iter_filtered_files(self, root_path, allowed_extensions, selection, output, current_path=None, rel_prefix="", level=0,
+                            ignore=None, visited=None):
+        """
+        逐个产出勾选且后缀匹配的文件 (完整路径, 相对路径, 大小)，同时把目录树行追加到 output
+        selection 为勾选状态快照，None 表示直接使用当前状态
+        目录列表取自 dir_index，没有任何勾选项的子树整棵跳过；ignore 为忽略规则，None 表示使用当前规则
+        visited 不为 None 时记录遍历过的目录及其 mtime (监视变化用)
+        """
+        if current_path is None: current_path = root_path
+        if selection is None: selection = self.selection
+        if visited is not None:
+            try: visited[current_path] = os.stat(current_path).st_mtime_ns
+            except OSError: pass
+        entries = self.dir_index.list(current_path)
+        if entries is None: return
+        entries = (ignore or self.ignore).filter(current_path, entries)
+
+        dirs, plain_files = [], []
+        for entry in entries:
+            name, full_path, is_dir, is_link = entry[:4]
+            if is_dir:
+                # 只过滤忽略名单，不要因为父目录未选中就阻止遍历子目录
+                if name not in self.IGNORE_DIRS and not is_link and not selection.is_pruned(full_path):
+                    dirs.append(entry)
+            elif name not in self.IGNORE_FILES:
+                plain_files.append(entry)
+        dirs.sort(key=lambda e: e[0])
+        plain_files.sort(key=lambda e: e[0])
+
+        # 显示逻辑：如果是根目录，或者该目录被显式选中，则打印目录行
+        # (如果目录没选但子文件选了，目录行不显示，只显示缩进后的文件名，这样保持了逻辑一致性)
+        folder_name = os.path.basename(current_path)
+        if current_path == root_path or selection.is_selected(current_path):
+            if level == 0: output.append(f"{folder_name}/")
+            else: output.append(f"{'    ' * level}|-- {folder_name}/")
+
+        sub_indent = "    " * (level + 1)
+        for name, full_path, _, _, size, _ in plain_files:
+            # 核心判断：直接判断具体文件是否被勾选
+            if not selection.is_selected(full_path): continue
+            output.append(f"{sub_indent}|-- {name}")
+            if name.lower().endswith(allowed_extensions):
+                yield full_path, rel_prefix + name, size
+
+        for name, full_path, _, _, _, _ in dirs:
+            yield from self.iter_filtered_files(root_path, allowed_extensions, selection, output,
+                                                full_path, rel_prefix + name + "/", level + 1, ignore, visited)
+
+    def _render_file_block(self, full_path, rel_path, cache=None):
+        """渲染单个文件；疑似二进制的文件返回 None"""
+        try:
+            if cache is not None:
+                st = os.stat(full_path)
+                block = cache.lookup(rel_path, st)
+                if block is not None: return block
+            data = read_source_bytes(full_path)
+            if data is None: return None
+            content = decode_source_text(data)
+            fence = "`" * max(3, longest_backtick_run(content) + 1)
+            block = self._format_block(full_path, rel_path, content, fence)
+            if cache is not None: cache.store(rel_path, st, block)
+            return block
+        except Exception as e:
+            return f"```text\n# Error: {e}\n```\n\n"
+
+    def _render_file_block_timed(self, full_path, rel_path, cache, stats):
+        """性能统计开启时使用：逻辑同 _render_file_block，逐阶段计时"""
+        clock = time.perf_counter
+        start = clock()
+        try:
+            if cache is not None:
+                st = os.stat(full_path)
+                block = cache.lookup(rel_path, st)
+                stats.add("cache", clock() - start)
+                if block is not None:
+                    stats.file_done(rel_path, clock() - start)
+                    return block
+            t0 = clock()
+            data = read_source_bytes(full_path)
+            t1 = clock()
+            stats.add("read", t1 - t0)
+            if data is None:
+                stats.skip("binary")
+                return None
+            content = decode_source_text(data)
+            t2 = clock()
+            fence = "`" * max(3, longest_backtick_run(content) + 1)
+            t3 = clock()
+            block = self._format_block(full_path, rel_path, content, fence)
+            t4 = clock()
+            if cache is not None: cache.store(rel_path, st, block)
+            stats.add("decode", t2 - t1)
+            stats.add("fence", t3 - t2)
+            stats.add("render", t4 - t3)
+            stats.count("bytes_read", len(data))
+            stats.file_done(rel_path, clock() - start)
+            return block
+        except Exception as e:
+            stats.skip(type(e).__name__)
+            return f"```text\n# Error: {e}\n```\n\n"
+
+    @staticmethod
+    def _format_block(full_path, rel_path, content, fence):
+        ext = os.path.splitext(full_path)[1].lower().replace('.', '')
+        lang = "python" if ext == "py" else ext
+        # .ref / .delete 文件不能使用引用块、删除列表块的标记，否则还原时会被当作引用或删除列表
+        if not lang or lang in (REF_LANG, DELETE_LANG): lang = "text"
+        return f"{fence}{lang}\n# {rel_path}\n{content}\n{fence}\n\n"
 
     # ================= Restore & Utils =================
 
     def restore_project(self):
         target_root = self.path_entry.get().strip()
-        full_text = self.text_area.get(1.0, tk.END)
         
         if not target_root:
             messagebox.showwarning("提示", "请选择目标文件夹")
@@ -446,12 +1407,94 @@ class CodeMergerApp:
         if not os.path.exists(target_root):
             os.makedirs(target_root)
 
-        lines = full_text.split('\n')
+        counts = {"new": 0, "written": 0, "unchanged": 0, "deleted": 0}
+        # 按行分批从文本框取内容并流式解析，每个代码块闭合后立即写入
+        for current_path, content, lang in self._iter_markdown_blocks(self._iter_text_lines()):
+            try:
+                if lang == DELETE_LANG:
+                    # 删除列表：只删除目标目录内的普通文件
+                    for rel_path in filter(None, map(str.strip, content.split("\n"))):
+                        full_path = self._safe_join(target_root, rel_path)
+                        if full_path and os.path.isfile(full_path) and not os.path.islink(full_path):
+                            os.unlink(full_path)
+                            counts["deleted"] += 1
+                    continue
+                full_path = os.path.join(target_root, current_path)
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if lang == REF_LANG:
+                    # 引用块：复制已还原的源文件，源路径不得跳出目标目录
+                    source = self._safe_join(target_root, content.strip())
+                    if source is None: continue
+                    with open(source, "rb") as f:
+                        counts[self._write_bytes_if_changed(full_path, f.read())] += 1
+                else:
+                    counts[self._write_if_changed(full_path, content)] += 1
+            except Exception: pass
+        deleted = counts.pop("deleted")
+        messagebox.showinfo("还原完成", f"已还原 {sum(counts.values())} 个文件\n"
+                            f"新建 {counts['new']} 个, 更新 {counts['written']} 个, 未变化 {counts['unchanged']} 个"
+                            + (f", 删除 {deleted} 个" if deleted else ""))
+
+    @staticmethod
+    def _safe_join(target_root, rel_path):
+        """拼接目标目录内的路径；绝对路径或向上跳出目标目录时返回 None"""
+        norm = os.path.normpath(rel_path)
+        if os.path.isabs(norm) or norm.split(os.sep)[0] == "..": return None
+        return os.path.join(target_root, norm)
+
+    def _write_if_changed(self, full_path, content):
+        """
+        内容与已有文件一致时跳过写入（先比大小再比哈希），避免触发文件监听与重新构建；
+        需要写入时先写临时文件再 rename，保证原子替换
+        返回 "new" / "written" / "unchanged"
+        """
+        if os.linesep != "\n":
+            content = content.replace("\n", os.linesep)
+        return self._write_bytes_if_changed(full_path, content.encode("utf-8"))
+
+    def _write_bytes_if_changed(self, full_path, data):
+        try:
+            st = os.stat(full_path)
+        except FileNotFoundError:
+            st = None
+        if st is not None and st.st_size == len(data):
+            h = hashlib.sha1()
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""): h.update(chunk)
+            if h.digest() == hashlib.sha1(data).digest():
+                return "unchanged"
+
+        if st is not None:
+            mode = stat.S_IMODE(st.st_mode)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path) or ".", prefix=".cm-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f: f.write(data)
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            try: os.unlink(tmp_path)
+            except OSError: pass
+            raise
+        return "new" if st is None else "written"
+
+    def _iter_text_lines(self, batch_lines=2000):
+        """分批读取文本框内容，避免一次性复制整个缓冲区"""
+        last_line = int(self.text_area.index("end-1c").split(".")[0])
+        for start in range(1, last_line + 1, batch_lines):
+            end = min(start + batch_lines - 1, last_line)
+            chunk = self.text_area.get(f"{start}.0", f"{end}.end")
+            for line in chunk.split("\n"):
+                yield line
+
+    def _iter_markdown_blocks(self, lines):
+        """状态机解析：逐行消费输入，每遇到闭合栅栏即产出 (相对路径, 文件内容, 语言标记)"""
         STATE_OUTSIDE, STATE_EXPECT_PATH, STATE_INSIDE = 0, 1, 2
         current_state = STATE_OUTSIDE
-        current_fence, current_path, code_buffer = "", "", []
-        success_count = 0
-        import re
+        current_fence, current_lang, current_path, code_buffer = "", "", "", []
 
         for line in lines:
             stripped = line.strip()
@@ -459,7 +1502,7 @@ class CodeMergerApp:
                 if stripped.startswith("```"):
                     match = re.match(r'^(`+)(.*)', stripped)
                     if match:
-                        current_fence = match.group(1)
+                        current_fence, current_lang = match.group(1), match.group(2).strip()
                         current_state = STATE_EXPECT_PATH
                         code_buffer = []
             elif current_state == STATE_EXPECT_PATH:
@@ -470,27 +1513,113 @@ class CodeMergerApp:
                 else: current_state = STATE_OUTSIDE
             elif current_state == STATE_INSIDE:
                 if stripped == current_fence:
-                    try:
-                        full_path = os.path.join(target_root, current_path)
-                        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-                        with open(full_path, "w", encoding="utf-8") as f:
-                            f.write("\n".join(code_buffer))
-                        success_count += 1
-                    except Exception: pass
+                    yield current_path, "\n".join(code_buffer), current_lang
                     current_state = STATE_OUTSIDE
                     code_buffer = []
                 else:
                     code_buffer.append(line)
-        messagebox.showinfo("还原完成", f"已还原 {success_count} 个文件")
 
     def clear_text(self):
+        self.stop_watch()
+        self._last_watch_job = None
         self.text_area.delete(1.0, tk.END)
         self.update_stats()
 
+    # ================= Status Statistics =================
+    # 统计数据按修改范围增量维护：拦截文本框的 insert/delete 命令，只查看被修改的那几行；
+    # 状态栏刷新做防抖，连续输入时不会在每次按键后重新计算整个缓冲区
+
+    BLOCK_PATTERN = re.compile(r'^[ \t]*`{3,}[^`\n]*\n[ \t]*#', re.MULTILINE)
+
+    def _install_text_proxy(self):
+        widget = self.text_area._w
+        self._text_orig = widget + "_orig"
+        self.text_area.tk.call("rename", widget, self._text_orig)
+        self.text_area.tk.createcommand(widget, self._text_proxy)
+        self._stat_chars = 0
+        self._stat_wide = 0    # 多字节字符的近似数量，用于估算 token
+        self._stat_blocks = 0  # 以 "栅栏 + # 路径" 开头的文件代码块数量
+        self._stats_job = None
+        self._stats_dirty = False
+
+    def _tk_text(self, *args):
+        return self.text_area.tk.call((self._text_orig,) + args)
+
+    def _tk_index(self, index):
+        return str(self._tk_text("index", index))
+
+    def _tk_compare(self, a, op, b):
+        return self.text_area.tk.getboolean(self._tk_text("compare", a, op, b))
+
+    def _last_line(self):
+        return int(self._tk_index("end-1c").split(".")[0])
+
+    def _count_blocks(self, first_line, last_line):
+        last_line = min(last_line, self._last_line())
+        first_line = max(first_line, 1)
+        if last_line < first_line: return 0
+        text = str(self._tk_text("get", f"{first_line}.0", f"{last_line}.end"))
+        return sum(1 for _ in self.BLOCK_PATTERN.finditer(text))
+
+    @staticmethod
+    def _wide_chars(text):
+        return (len(text.encode("utf-8")) - len(text)) // 2
+
+    def _text_proxy(self, cmd, *args):
+        editable = cmd in ("insert", "delete") and str(self._tk_text("cget", "-state")) == tk.NORMAL
+        if cmd == "insert" and editable and len(args) >= 2:
+            index = self._tk_index(args[0])
+            if self._tk_compare(index, "==", "end"):
+                index = self._tk_index("end-1c")
+            line = int(index.split(".")[0])
+            text = "".join(args[1::2])
+            before = self._count_blocks(line - 1, line + 1)
+            result = self._tk_text(cmd, *args)
+            self._stat_chars += len(text)
+            self._stat_wide += self._wide_chars(text)
+            self._stat_blocks += self._count_blocks(line - 1, line + text.count("\n") + 1) - before
+        elif cmd == "delete" and editable and 1 <= len(args) <= 2:
+            start = self._tk_index(args[0])
+            end = self._tk_index(args[1] if len(args) == 2 else f"{args[0]}+1c")
+            if self._tk_compare(end, ">", "end-1c"):
+                end = self._tk_index("end-1c")
+            if not self._tk_compare(start, "<", end):
+                return self._tk_text(cmd, *args)
+            first, last = int(start.split(".")[0]), int(end.split(".")[0])
+            removed = str(self._tk_text("get", start, end))
+            before = self._count_blocks(first - 1, last + 1)
+            result = self._tk_text(cmd, *args)
+            self._stat_chars -= len(removed)
+            self._stat_wide -= self._wide_chars(removed)
+            self._stat_blocks += self._count_blocks(first - 1, first + 1) - before
+        else:
+            result = self._tk_text(cmd, *args)
+            # 撤销/重做与其他批量修改不经过 insert/delete 命令，延迟做一次完整重算
+            if editable or cmd == "replace" or (cmd == "edit" and args and args[0] in ("undo", "redo")):
+                self._stats_dirty = True
+        return result
+
+    def _on_text_modified(self, event=None):
+        self.text_area.edit_modified(False)
+        if self._stats_job is not None:
+            self.root.after_cancel(self._stats_job)
+        self._stats_job = self.root.after(300, self.update_stats)
+
+    def _recount_stats(self):
+        content = str(self._tk_text("get", "1.0", "end-1c"))
+        self._stat_chars = len(content)
+        self._stat_wide = self._wide_chars(content)
+        self._stat_blocks = sum(1 for _ in self.BLOCK_PATTERN.finditer(content))
+        self._stats_dirty = False
+
     def update_stats(self, event=None):
-        content = self.text_area.get(1.0, tk.END).rstrip()
-        lines = len(content.split('\n')) if content else 0
-        self.stats_label.config(text=f"Lines: {lines} | Chars: {len(content)}")
+        self._stats_job = None
+        if self._stats_dirty:
+            self._recount_stats()
+        chars = self._stat_chars
+        lines = self._last_line() if chars else 0
+        tokens = (chars - self._stat_wide) // 4 + self._stat_wide
+        self.stats_label.config(text=f"Lines: {lines} | Chars: {chars} | Blocks: {self._stat_blocks} | ~Tokens: {tokens}")
 
     def copy_to_clipboard(self):
         self.root.clipboard_clear()
@@ -0,0 +1,66 @@
+"""
+栅栏扫描微基准：对比旧的 re.findall 方案与 BacktickScanner
+
+用法: python bench_fence.py [--repeat N]
+"""
+import argparse
+import random
+import re
+import timeit
+
+from code_merger import BacktickScanner
+
+def regex_longest(content):
+    """旧实现：re.findall 收集所有反引号串后再求最大值"""
+    ticks = re.findall(r'`+', content)
+    return max(len(t) for t in ticks) if ticks else 0
+
+def scanner_longest(content):
+    return BacktickScanner().feed(content).longest
+
+def chunked_longest(content, chunk_size=64 * 1024):
+    """分块增量输入，模拟流式读取"""
+    scanner = BacktickScanner()
+    for i in range(0, len(content), chunk_size):
+        scanner.feed(content[i:i + chunk_size])
+    return scanner.longest
+
+def build_samples():
+    rnd = random.Random(42)
+    code_line = "def handler(request):  # normal python source\n    return request.json()\n"
+    md_line = "Use `foo()` or ``bar`` and see ```text block``` for details.\n"
+    return {
+        "plain code (2 MB)": code_line * (2 * 1024 * 1024 // len(code_line)),
+        "markdown heavy (2 MB)": md_line * (2 * 1024 * 1024 // len(md_line)),
+        "random ticks (1 MB)": "".join(rnd.choice("``ab \n") for _ in range(1024 * 1024)),
+        "one huge run (1 MB)": "x" * 1000 + "`" * (1024 * 1024) + "x",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="反引号栅栏扫描微基准")
+    parser.add_argument('--repeat', type=int, default=5, help='每项重复次数 (取最小值)')
+    args = parser.parse_args()
+
+    methods = [
+        ("re.findall", regex_longest),
+        ("scanner(str)", scanner_longest),
+        ("scanner(bytes)", None),
+        ("scanner(chunked)", chunked_longest),
+    ]
+
+    print(f"{'样本':<24}{'方法':<20}{'耗时(ms)':>12}{'最长':>10}")
+    for name, text in build_samples().items():
+        data = text.encode("utf-8")
+        expected = regex_longest(text)
+        for label, func in methods:
+            if func is None:
+                target, func = data, scanner_longest
+            else:
+                target = text
+            result = func(target)
+            assert result == expected, f"{label} 结果不一致: {result} != {expected}"
+            cost = min(timeit.repeat(lambda: func(target), number=1, repeat=args.repeat))
+            print(f"{name:<24}{label:<20}{cost * 1000:>12.2f}{result:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+端到端基准：生成合成工程，测量导出 / 还原 / GUI 提取的吞吐与峰值内存，并校验往返一致性
+
+用法:
+    python benchmark.py --files 2000 --jobs 1,8 --output result.json
+    python benchmark.py --baseline result.json --threshold 0.15   # 与上次结果比较，退化超过阈值时退出码为 1
+
+每次测量都在独立子进程中运行 (与实际命令行调用一致)，峰值内存取自该子进程的 rusage
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from code_merger import IGNORE_DIRS, IGNORE_FILES, decode_source, encode_for_disk, looks_binary, SNIFF_BYTES, target_extensions
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLI = os.path.join(HERE, "code_merger.py")
+REPO_ROOT = os.path.dirname(HERE)
+
+EXTENSIONS = (".py", ".md", ".txt", ".json", ".js")
+CODE_LINES = (
+    "def handler(request, *args, **kwargs):",
+    "    result = compute(request.payload, retries=3)",
+    "    return {\"status\": \"ok\", \"value\": result}",
+    "class Service(BaseService):",
+    "    # 处理用户请求并记录日志",
+    "for index, item in enumerate(items):",
+    "    logger.info(\"processing %s\", item)",
+    "",
+)
+
+# GUI 提取路径：在子进程中无界面地驱动 app.py 的导出后台线程，按界面线程的方式消费队列
+GUI_CHILD = """
+import sys, queue, threading
+sys.path.insert(0, sys.argv[1])
+import app
+gui = app.CodeMergerApp.__new__(app.CodeMergerApp)
+gui.IGNORE_DIRS = set(sys.argv[3].split("|"))
+gui.IGNORE_FILES = set(sys.argv[4].split("|"))
+gui.READ_JOBS = int(sys.argv[5])
+gui.selection = app.SelectionTree(sys.argv[2])
+gui.dir_index = app.DirIndex()
+gui.ignore = app.IgnoreMatcher(sys.argv[2])
+job = {
+    "queue": queue.Queue(maxsize=512), "cancel": threading.Event(),
+    "files_total": 0, "bytes_total": 0, "files_done": 0, "bytes_done": 0,
+    "written": 0, "skipped": 0, "error": None, "stats": None, "watch": None, "marks": [],
+}
+threading.Thread(target=gui._export_worker,
+                 args=(job, sys.argv[2], tuple(sys.argv[6].split("|")), None, False, (0, 0), gui.ignore),
+                 daemon=True).start()
+blocks, tree = ["## Code Contents\\n\\n"], ""
+while True:
+    msg = job["queue"].get()
+    if msg[0] == "block":
+        if msg[1] is not None:
+            blocks.append(msg[1])
+            job["written"] += 1
+    elif msg[0] == "tree":
+        tree = "## Project Structure\\n```text\\n" + msg[1] + "\\n```\\n\\n"
+    elif msg[0] == "error":
+        raise SystemExit(msg[1])
+    elif msg[0] == "done":
+        break
+content = tree + "".join(blocks)
+print(job["written"], len(content))
+"""
+
+def _make_line(rnd, backtick_density):
+    line = rnd.choice(CODE_LINES)
+    if rnd.random() < backtick_density:
+        # 行内反引号串，长度偏向短串，偶尔出现很长的串
+        ticks = "`" * min(int(rnd.expovariate(0.5)) + 1, 12)
+        line = f"{line}  # see {ticks}code{ticks}"
+    return line
+
+def generate_tree(root, files=2000, depth=4, mean_kb=4.0, sigma=1.0, backtick_density=0.05,
+                  non_utf8_ratio=0.02, binary_ratio=0.0, seed=42):
+    """
+    生成合成工程：文件大小服从对数正态分布 (中位数 mean_kb)，目录层级不超过 depth
+    non_utf8_ratio 比例的文件以 GB18030 编码，binary_ratio 比例的文件为随机字节 (后缀仍为代码后缀)
+    返回生成的文件列表 [(相对路径, 是否文本)]
+    """
+    rnd = random.Random(seed)
+    dirs = [""]
+    for i in range(max(1, files // 10)):
+        parent = rnd.choice(dirs)
+        if parent.count("/") >= depth:
+            continue
+        dirs.append(f"{parent}pkg{i}/")
+    mu = math.log(mean_kb * 1024)
+
+    created = []
+    for i in range(files):
+        rel_path = f"{rnd.choice(dirs)}mod{i}{rnd.choice(EXTENSIONS)}"
+        full_path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        size = max(1, int(rnd.lognormvariate(mu, sigma)))
+        if rnd.random() < binary_ratio:
+            with open(full_path, "wb") as f:
+                f.write(bytes(rnd.getrandbits(8) for _ in range(min(size, 64 * 1024))))
+            created.append((rel_path, False))
+            continue
+        lines, used = [], 0
+        while used < size:
+            line = _make_line(rnd, backtick_density)
+            lines.append(line)
+            used += len(line) + 1
+        text = "\n".join(lines) + "\n"
+        encoding = "gb18030" if rnd.random() < non_utf8_ratio else "utf-8"
+        with open(full_path, "wb") as f:
+            f.write(text.encode(encoding))
+        created.append((rel_path, True))
+    return created
+
+def run_measured(args, cwd=None):
+    """运行子进程并返回 (耗时秒, 峰值内存 MB 或 None)"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(args, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status >> 8
+        stderr = proc.stderr.read()
+        # Linux 以 KB 为单位，macOS 以字节为单位
+        rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    else:
+        _, stderr = proc.communicate()
+        elapsed = time.perf_counter() - start
+        rss = None
+    proc.stderr.close()
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} 失败:\n{stderr.decode('utf-8', errors='replace')}")
+    return elapsed, rss
+
+def best_of(repeat, func):
+    """重复测量取耗时最短的一次，峰值内存取最大值"""
+    times, rss = [], []
+    for _ in range(repeat):
+        elapsed, peak = func()
+        times.append(elapsed)
+        if peak is not None:
+            rss.append(peak)
+    return min(times), (max(rss) if rss else None)
+
+def summarize(seconds, files, nbytes, rss):
+    return {
+        "seconds": round(seconds, 4),
+        "files_per_s": round(files / seconds, 1),
+        "mb_per_s": round(nbytes / 1048576 / seconds, 2),
+        "peak_rss_mb": round(rss, 1) if rss is not None else None,
+    }
+
+def source_files(src, created):
+    """导出应包含的文件：文本、后缀匹配、不在忽略名单中"""
+    expected = []
+    for rel_path, _ in created:
+        parts = rel_path.split("/")
+        if not rel_path.endswith(target_extensions) or parts[-1] in IGNORE_FILES:
+            continue
+        if any(part in IGNORE_DIRS for part in parts[:-1]):
+            continue
+        with open(os.path.join(src, rel_path), "rb") as f:
+            data = f.read()
+        if looks_binary(data[:SNIFF_BYTES]):
+            continue
+        expected.append((rel_path, data))
+    return expected
+
+def check_roundtrip(expected, restored_dir):
+    """还原结果应等于源文件按导出规则解码后再写回磁盘的内容"""
+    mismatches = []
+    for rel_path, data in expected:
+        try:
+            with open(os.path.join(restored_dir, rel_path), "rb") as f:
+                restored = f.read()
+        except OSError:
+            mismatches.append(rel_path)
+            continue
+        if restored != encode_for_disk(decode_source(data)):
+            mismatches.append(rel_path)
+    return mismatches
+
+def compare(results, baseline, threshold):
+    """吞吐下降或峰值内存上升超过 threshold (比例) 即视为退化，返回退化项描述"""
+    regressions = []
+    print(f"\n{'项目':<22}{'基线 files/s':>14}{'当前 files/s':>14}{'变化':>9}{'基线 RSS':>10}{'当前 RSS':>10}")
+    for name, current in results.items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            continue
+        change = current["files_per_s"] / old["files_per_s"] - 1
+        print(f"{name:<22}{old['files_per_s']:>14}{current['files_per_s']:>14}{change:>+9.1%}"
+              f"{old['peak_rss_mb'] or '-':>10}{current['peak_rss_mb'] or '-':>10}")
+        if change < -threshold:
+            regressions.append(f"{name}: 吞吐下降 {-change:.1%}")
+        if old["peak_rss_mb"] and current["peak_rss_mb"] and current["peak_rss_mb"] > old["peak_rss_mb"] * (1 + threshold):
+            regressions.append(f"{name}: 峰值内存 {old['peak_rss_mb']} -> {current['peak_rss_mb']} MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="导出/还原端到端基准 (合成工程)")
+    parser.add_argument('--files', type=int, default=2000, help='文件数 (默认 2000)')
+    parser.add_argument('--depth', type=int, default=4, help='最大目录深度 (默认 4)')
+    parser.add_argument('--mean-kb', type=float, default=4.0, help='文件大小中位数 KB，对数正态分布 (默认 4)')
+    parser.add_argument('--sigma', type=float, default=1.0, help='文件大小分布的离散度 (默认 1.0)')
+    parser.add_argument('--backtick-density', type=float, default=0.05, help='含反引号串的行所占比例 (默认 0.05)')
+    parser.add_argument('--non-utf8', type=float, default=0.02, help='GB18030 编码文件所占比例 (默认 0.02)')
+    parser.add_argument('--binary', type=float, default=0.0, help='误用代码后缀的二进制文件所占比例 (默认 0)')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    parser.add_argument('--jobs', default="1,4", help='要测量的并发线程数，逗号分隔 (默认 1,4)')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最快一次 (默认 3)')
+    parser.add_argument('--gui', action='store_true', help='同时测量 GUI 提取路径 (需要 tkinter)')
+    parser.add_argument('--workdir', help='合成工程与输出的存放目录 (默认临时目录，结束后删除)')
+    parser.add_argument('--output', help='结果写入 JSON 文件')
+    parser.add_argument('--baseline', help='与之前的 JSON 结果比较')
+    parser.add_argument('--threshold', type=float, default=0.10, help='退化阈值比例 (默认 0.10)')
+    args = parser.parse_args()
+
+    jobs_list = [int(j) for j in args.jobs.split(",") if j.strip()]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cm-bench-")
+    src = os.path.join(workdir, "src")
+    try:
+        shutil.rmtree(src, ignore_errors=True)
+        print(f"生成合成工程: {args.files} 个文件 -> {src}")
+        created = generate_tree(src, args.files, args.depth, args.mean_kb, args.sigma,
+                                args.backtick_density, args.non_utf8, args.binary, args.seed)
+        expected = source_files(src, created)
+        src_bytes = sum(len(data) for _, data in expected)
+        print(f"待导出文本文件 {len(expected)} 个, {src_bytes / 1048576:.1f} MB")
+
+        results = {}
+        mismatches = []
+        md_file = os.path.join(workdir, "project.md")
+        restored = os.path.join(workdir, "restored")
+        for jobs in jobs_list:
+            seconds, rss = best_of(args.repeat, lambda: run_measured(
+                [sys.executable, CLI, "-e", "-i", src, "-o", md_file, "-j", str(jobs)]))
+            results[f"export_j{jobs}"] = summarize(seconds, len(expected), src_bytes, rss)
+            md_bytes = os.path.getsize(md_file)
+
+            def restore_once():
+                shutil.rmtree(restored, ignore_errors=True)
+                return run_measured([sys.executable, CLI, "-r", "-i", md_file, "-o", restored, "-j", str(jobs)])
+            seconds, rss = best_of(args.repeat, restore_once)
+            results[f"restore_j{jobs}"] = summarize(seconds, len(expected), md_bytes, rss)
+            mismatches.extend(f"j{jobs}: {p}" for p in check_roundtrip(expected, restored))
+
+        if args.gui:
+            gui_args = [sys.executable, "-c", GUI_CHILD, REPO_ROOT, src, "|".join(IGNORE_DIRS),
+                        "|".join(IGNORE_FILES), str(max(jobs_list)), "|".join(target_extensions)]
+            try:
+                seconds, rss = best_of(args.repeat, lambda: run_measured(gui_args))
+                results["gui_generate"] = summarize(seconds, len(expected), src_bytes, rss)
+            except RuntimeError as e:
+                print(f"跳过 GUI 基准: {e}")
+
+        print(f"\n{'项目':<22}{'耗时(s)':>10}{'files/s':>12}{'MB/s':>10}{'峰值RSS(MB)':>14}")
+        for name, r in results.items():
+            print(f"{name:<22}{r['seconds']:>10}{r['files_per_s']:>12}{r['mb_per_s']:>10}{r['peak_rss_mb'] or '-':>14}")
+        print(f"往返校验: {'通过' if not mismatches else f'{len(mismatches)} 个文件不一致'}")
+        for item in mismatches[:20]:
+            print(f"  {item}")
+
+        report = {
+            "meta": {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "params": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "workdir")},
+                "files": len(expected),
+                "source_bytes": src_bytes,
+            },
+            "results": results,
+            "roundtrip": {"ok": not mismatches, "mismatches": mismatches},
+        }
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"结果已写入 {os.path.abspath(args.output)}")
+
+        regressions = []
+        if args.baseline:
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+            base_params = dict(baseline.get("meta", {}).get("params", {}))
+            if {k: v for k, v in base_params.items() if k != "threshold"} != \
+                    {k: v for k, v in report["meta"]["params"].items() if k != "threshold"}:
+                print("警告: 基线使用的生成参数与本次不同，结果不具可比性")
+            regressions = compare(results, baseline, args.threshold)
+            for item in regressions:
+                print(f"退化: {item}")
+        if mismatches or regressions:
+            sys.exit(1)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,30 @@
 import os
+import io
 import argparse
+import codecs
+import collections
+import contextlib
+import fnmatch
+import glob
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
 import re
+import select
+import sqlite3
+import stat
+import struct
+import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 # 忽略配置
 IGNORE_DIRS = {'.git', '__pycache__', '.idea', '.vscode', 'venv', 'env', 'node_modules', 'build', 'dist', '.mypy_cache'}
@@ -9,109 +32,1984 @@ IGNORE_FILES = {'.DS_Store', 'Thumbs.db'}
 # 允许处理的文件后缀
 target_extensions = (".py", ".md", ".txt", ".json", ".yaml", ".yml", ".html", ".css", ".js", ".sh", ".conf", ".ini")
 
+# 进度信息输出流：Markdown 写往 stdout 时切换为 stderr，避免污染管道
+_log_stream = None
+
+def log(*args, **kwargs):
+    """打印进度信息"""
+    print(*args, file=_log_stream or sys.stdout, **kwargs)
+
+@contextlib.contextmanager
+def open_output(output_file):
+    """
+    打开导出目标 (二进制流，代码块由 write_block 写入)：普通路径写文件，"-" 写 stdout（便于直接管道给其他进程）
+    写 stdout 时进度信息切换到 stderr，由 export_to_markdown 在输出完汇总信息后恢复
+    """
+    global _log_stream
+    if output_file == "-":
+        _log_stream = sys.stderr
+        try:
+            yield sys.stdout.buffer
+        finally:
+            sys.stdout.buffer.flush()
+    else:
+        with open(output_file, "wb") as f:
+            yield f
+
+class Stats:
+    """
+    --stats 的计时与计数：各阶段累计耗时、读写字节数、按原因统计的跳过文件、最慢的 N 个文件
+    未启用时调用方传 None，热路径上只多一次 None 判断
+    阶段耗时为各线程的累计值，并发时之和可能超过总耗时
+    """
+    PHASES = ("walk", "cache", "read", "decode", "fence", "render", "dedup", "parse", "encode", "write")
+
+    def __init__(self, top_n=10):
+        self.top_n = top_n
+        self.started = time.perf_counter()
+        self.phases = collections.Counter()
+        self.counters = collections.Counter()
+        self.skipped = collections.Counter()
+        self._slowest = []
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def skip(self, reason):
+        with self._lock:
+            self.skipped[reason] += 1
+
+    def file_done(self, rel_path, seconds):
+        """记录单个文件的处理耗时，只保留最慢的 top_n 个"""
+        with self._lock:
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, (seconds, rel_path))
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, (seconds, rel_path))
+
+    def timed_iter(self, phase, iterable):
+        """包装迭代器，把每次取下一项的耗时计入 phase"""
+        clock = time.perf_counter
+        iterator = iter(iterable)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(phase, clock() - start)
+                return
+            self.add(phase, clock() - start)
+            yield item
+
+    def to_dict(self):
+        return {
+            "elapsed": round(time.perf_counter() - self.started, 4),
+            "phases": {name: round(self.phases[name], 4) for name in self.PHASES if name in self.phases},
+            "counters": dict(self.counters),
+            "skipped": dict(self.skipped),
+            "slowest": [{"path": path, "seconds": round(seconds, 4)}
+                        for seconds, path in sorted(self._slowest, reverse=True)],
+        }
+
+    def print_summary(self):
+        data = self.to_dict()
+        log(f"\n== 统计 (总耗时 {data['elapsed']:.3f}s) ==")
+        for name, seconds in data["phases"].items():
+            log(f"  {name:<8}{seconds:>10.3f}s")
+        for name, value in sorted(data["counters"].items()):
+            log(f"  {name:<16}{value:>12}")
+        if data["skipped"]:
+            log("  跳过: " + ", ".join(f"{reason} {n}" for reason, n in sorted(data["skipped"].items())))
+        if data["slowest"]:
+            log(f"  最慢的 {len(data['slowest'])} 个文件:")
+            for item in data["slowest"]:
+                log(f"    {item['seconds']:>8.4f}s  {item['path']}")
+
+class FileRecord:
+    """待提取的文件：保存路径及遍历时拿到的 DirEntry，便于复用其 stat 缓存"""
+    __slots__ = ("path", "rel_path", "entry")
+
+    def __init__(self, path, rel_path, entry=None):
+        self.path = path
+        self.rel_path = rel_path
+        self.entry = entry
+
+    def stat(self):
+        if self.entry is not None:
+            return self.entry.stat()
+        return os.stat(self.path)
+
+    def read(self):
+        return read_source(self.path)
+
+    def read_buffer(self):
+        return map_source(self.path)
+
+# 忽略规则文件：每个目录下的 .gitignore / .ignore 作用于该目录子树，工程根目录的 .codemergerignore 作用于整个工程
+# 优先级 (与 ripgrep 一致)：深层目录的规则优先；同一目录内 .codemergerignore > .ignore > .gitignore
+IGNORE_FILE_NAMES = (".gitignore", ".ignore")
+PROJECT_IGNORE_FILE = ".codemergerignore"
+
+def _glob_to_regex(pattern):
+    """把 gitignore 通配符翻译为正则：* 与 ? 不跨越 /，** 匹配任意层级目录"""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**/", i):
+                out.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern.startswith("**", i):
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 2)
+            if j == -1:
+                out.append("\\[")
+            else:
+                body = pattern[i + 1:j].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j + 1
+                continue
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+def parse_ignore_line(line):
+    """解析一行忽略规则，返回 (正则, 是否取反, 是否仅匹配目录)；空行与注释返回 None"""
+    line = line.rstrip("\r\n")
+    if not line or line.startswith("#"):
+        return None
+    # 行尾空格忽略，除非用反斜杠转义
+    stripped = line.rstrip(" ")
+    if stripped != line and stripped.endswith("\\"):
+        stripped += " "
+    line = stripped
+    negate = line.startswith("!")
+    if negate or line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    # 含 / 的规则相对于忽略文件所在目录，否则匹配任意层级的同名项
+    anchored = "/" in line
+    regex = _glob_to_regex(line.lstrip("/"))
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return regex, negate, dir_only
+
+class IgnoreRules:
+    """
+    单个忽略文件编译后的规则
+    所有规则倒序拼接为一个正则的各个分支：re 按顺序尝试分支，首个完整匹配的分支就是最后一条生效的规则，
+    因此每个路径只需一次 fullmatch 即可得出结论
+    """
+    __slots__ = ("_dir_re", "_dir_negate", "_file_re", "_file_negate")
+
+    def __init__(self, rules):
+        self._dir_re, self._dir_negate = self._compile(rules)
+        self._file_re, self._file_negate = self._compile([r for r in rules if not r[2]])
+
+    @staticmethod
+    def _compile(rules):
+        if not rules:
+            return None, ()
+        rules = rules[::-1]
+        regex = re.compile("|".join(f"({r[0]})" for r in rules), re.DOTALL)
+        return regex, tuple(r[1] for r in rules)
+
+    def match(self, rel_path, is_dir):
+        """命中忽略规则返回 True，命中取反规则返回 False，未命中返回 None"""
+        regex, negate = (self._dir_re, self._dir_negate) if is_dir else (self._file_re, self._file_negate)
+        if regex is None:
+            return None
+        m = regex.fullmatch(rel_path)
+        if m is None:
+            return None
+        return not negate[m.lastindex - 1]
+
+def compile_ignore_rules(lines):
+    """编译忽略文件的各行，没有有效规则时返回 None"""
+    rules = [rule for rule in map(parse_ignore_line, lines) if rule is not None]
+    return IgnoreRules(rules) if rules else None
+
+def load_ignore_rules(path):
+    """读取并编译一个忽略文件，文件不存在或没有有效规则时返回 None"""
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return compile_ignore_rules(f)
+    except OSError:
+        return None
+
+def is_ignored(chain, rel_path, is_dir):
+    """按 (相对目录前缀, 规则) 链判断路径是否被忽略：链尾 (更深/优先级更高) 的规则先判断"""
+    for prefix, rules in reversed(chain):
+        result = rules.match(rel_path[len(prefix):], is_dir)
+        if result is not None:
+            return result
+    return False
+
+def extend_ignore_chain(chain, dir_path, rel_prefix, names):
+    """进入目录时，若目录下有忽略文件则把其规则追加到链尾 (根目录额外读取 .codemergerignore)"""
+    file_names = IGNORE_FILE_NAMES if rel_prefix else IGNORE_FILE_NAMES + (PROJECT_IGNORE_FILE,)
+    for name in file_names:
+        if name in names:
+            rules = load_ignore_rules(os.path.join(dir_path, name))
+            if rules is not None:
+                chain = chain + ((rel_prefix, rules),)
+    return chain
+
+def list_dir(dir_path, rel_prefix, ignore_chain=None):
+    """
+    列出单个目录中未被忽略的条目，返回 (子目录 DirEntry 列表, 文件 DirEntry 列表, 本目录的规则链)，均按名称排序
+    ignore_chain 为 None 时不读取忽略文件；目录无法读取时返回 None
+    """
+    try:
+        with os.scandir(dir_path) as it:
+            entries = list(it)
+    except OSError:
+        return None
+    if ignore_chain is not None:
+        ignore_chain = extend_ignore_chain(ignore_chain, dir_path, rel_prefix, {e.name for e in entries})
+
+    dirs = []
+    files = []
+    for entry in entries:
+        # DirEntry 自带类型信息，绝大多数平台上无需额外 stat
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            # 与 os.walk(followlinks=False) 一致：不进入符号链接目录
+            if entry.name not in IGNORE_DIRS and not entry.is_symlink():
+                if not ignore_chain or not is_ignored(ignore_chain, rel_prefix + entry.name, True):
+                    dirs.append(entry)
+        elif entry.name not in IGNORE_FILES:
+            if not ignore_chain or not is_ignored(ignore_chain, rel_prefix + entry.name, False):
+                files.append(entry)
+    dirs.sort(key=lambda e: e.name)
+    files.sort(key=lambda e: e.name)
+    return dirs, files, ignore_chain
+
+def _scan_dir(dir_path, rel_prefix, level, tree_lines, records, ignore_chain=None):
+    """
+    递归扫描单个目录：先列出文件，再按名称顺序进入子目录（与 os.walk 自顶向下的顺序一致）
+    ignore_chain 为 None 时不读取忽略文件；被忽略的子目录整棵跳过，不会被列出
+    """
+    listing = list_dir(dir_path, rel_prefix, ignore_chain)
+    if listing is None:
+        return
+    dirs, files, ignore_chain = listing
+
+    indent = "    " * level
+    folder_name = os.path.basename(os.path.normpath(dir_path))
+    if level == 0:
+        tree_lines.append(f"{folder_name}/")
+    else:
+        tree_lines.append(f"{indent}|-- {folder_name}/")
+
+    sub_indent = "    " * (level + 1)
+    for entry in files:
+        tree_lines.append(f"{sub_indent}|-- {entry.name}")
+        if entry.name.endswith(target_extensions):
+            records.append(FileRecord(entry.path, rel_prefix + entry.name, entry))
+
+    for entry in dirs:
+        _scan_dir(entry.path, rel_prefix + entry.name + "/", level + 1, tree_lines, records, ignore_chain)
+
+def scan_directory(root_path, use_ignore=True):
+    """
+    单次遍历：同时生成目录树文本和待提取文件列表
+    返回 (目录树字符串, [FileRecord, ...])，文件顺序即导出顺序
+    use_ignore 为 True 时遵循 .codemergerignore 与各级 .gitignore / .ignore
+    """
+    tree_lines = []
+    records = []
+    _scan_dir(root_path, "", 0, tree_lines, records, () if use_ignore else None)
+    return "\n".join(tree_lines), records
+
+# --git 模式：tracked 仅已跟踪文件；all 另含未跟踪且未被忽略的文件
+GIT_TRACKED = "tracked"
+GIT_ALL = "all"
+
+def find_git_worktree(path):
+    """向上查找 git 工作区，返回 (工作区根目录, git 目录)；不在 git 仓库中时返回 None"""
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, ".git")
+        if os.path.isdir(dot_git):
+            return path, dot_git
+        if os.path.isfile(dot_git):
+            # 链接工作区 / 子模块：.git 是指向真实 git 目录的文本文件
+            with open(dot_git, "r", encoding="utf-8") as f:
+                line = f.readline().strip()
+            if line.startswith("gitdir:"):
+                return path, os.path.normpath(os.path.join(path, line[len("gitdir:"):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+def _git_hash_size(git_dir):
+    """SHA-256 仓库的对象名为 32 字节，否则为 20 字节"""
+    config_dirs = [git_dir]
+    try:
+        with open(os.path.join(git_dir, "commondir"), "r", encoding="utf-8") as f:
+            config_dirs.append(os.path.join(git_dir, f.read().strip()))
+    except OSError:
+        pass
+    for config_dir in config_dirs:
+        try:
+            with open(os.path.join(config_dir, "config"), "r", encoding="utf-8", errors="replace") as f:
+                if re.search(r"objectformat\s*=\s*sha256", f.read(), re.IGNORECASE):
+                    return 32
+        except OSError:
+            continue
+    return 20
+
+def _read_varint(data, pos):
+    """git 索引 v4 的变长整数编码"""
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, pos
+
+def read_git_index(index_path, hash_size=20):
+    """
+    直接解析 git 索引文件 (版本 2/3/4)，返回按索引顺序排列的路径列表
+    冲突条目只保留一次，跳过子模块与稀疏检出 (skip-worktree) 条目；
+    拆分索引与稀疏索引需要借助 git 展开，遇到时抛出 ValueError
+    """
+    with open(index_path, "rb") as f:
+        data = f.read()
+    if len(data) < 12 or data[:4] != b"DIRC":
+        raise ValueError("不是有效的 git 索引文件")
+    version, count = struct.unpack_from(">II", data, 4)
+    if version not in (2, 3, 4):
+        raise ValueError(f"不支持的索引版本 {version}")
+
+    paths = []
+    offset = 12
+    prev = b""
+    flags_at = 40 + hash_size
+    for _ in range(count):
+        mode = struct.unpack_from(">I", data, offset + 24)[0]
+        flags = struct.unpack_from(">H", data, offset + flags_at)[0]
+        pos = offset + flags_at + 2
+        extended = 0
+        if flags & 0x4000:
+            extended = struct.unpack_from(">H", data, pos)[0]
+            pos += 2
+        if version == 4:
+            # 路径按前缀压缩：先去掉上一条路径末尾的若干字节，再接上本条的后缀
+            strip, pos = _read_varint(data, pos)
+            end = data.index(b"\0", pos)
+            path = prev[:len(prev) - strip] + data[pos:end]
+            offset = end + 1
+        else:
+            end = data.index(b"\0", pos)
+            path = data[pos:end]
+            # 条目以 1~8 个 NUL 填充到 8 字节对齐
+            offset += (end - offset + 8) & ~7
+        if path == prev:
+            continue
+        prev = path
+        kind = mode & 0o170000
+        if kind == 0o160000 or extended & 0x4000:
+            continue
+        if kind == 0o040000:
+            raise ValueError("稀疏索引")
+        paths.append(os.fsdecode(path))
+
+    # 扩展区：拆分索引的条目保存在共享索引中
+    end = len(data) - hash_size
+    while offset + 8 <= end:
+        signature, size = data[offset:offset + 4], struct.unpack_from(">I", data, offset + 4)[0]
+        if signature == b"link":
+            raise ValueError("拆分索引")
+        offset += 8 + size
+    return paths
+
+def list_git_files(source_dir, mode=GIT_TRACKED):
+    """
+    列出 git 工作区中 source_dir 下的文件，返回相对 source_dir、以 / 分隔的路径列表
+    tracked 模式直接解析 .git/index，格式不支持时再调用 git ls-files；
+    all 模式需要 git 命令列出未跟踪且未被忽略的文件
+    不在 git 仓库中或无法获取时返回 None，由调用方退回目录遍历
+    """
+    found = find_git_worktree(source_dir)
+    if found is None:
+        return None
+    top, git_dir = found
+    prefix = os.path.relpath(os.path.abspath(source_dir), top).replace(os.sep, "/")
+    prefix = "" if prefix == "." else prefix + "/"
+
+    if mode == GIT_TRACKED:
+        try:
+            paths = read_git_index(os.path.join(git_dir, "index"), _git_hash_size(git_dir))
+            return [p[len(prefix):] for p in paths if p.startswith(prefix)]
+        except (OSError, ValueError, IndexError, struct.error) as e:
+            log(f"无法直接读取 git 索引 ({e})，改用 git ls-files")
+
+    args = ["git", "ls-files", "-z", "--cached"]
+    if mode == GIT_ALL:
+        args += ["--others", "--exclude-standard"]
+    try:
+        # 在 source_dir 下执行时，输出路径即相对 source_dir
+        out = subprocess.run(args, cwd=source_dir, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return sorted({os.fsdecode(p) for p in out.split(b"\0") if p})
+
+def _render_path_tree(node, make_record, rel_prefix, name, level, tree_lines, records):
+    dirs, files = node
+    if level == 0:
+        tree_lines.append(f"{name}/")
+    else:
+        tree_lines.append(f"{'    ' * level}|-- {name}/")
+    sub_indent = "    " * (level + 1)
+    for file_name in sorted(files):
+        tree_lines.append(f"{sub_indent}|-- {file_name}")
+        if file_name.endswith(target_extensions):
+            records.append(make_record(rel_prefix + file_name))
+    for dir_name in sorted(dirs):
+        _render_path_tree(dirs[dir_name], make_record, rel_prefix + dir_name + "/", dir_name, level + 1,
+                          tree_lines, records)
+
+def scan_paths(root_path, rel_paths, use_ignore=True, load_rules=None, make_record=None):
+    """
+    由现成的相对路径列表 (如 git 索引、归档成员) 生成目录树与待提取文件，不列目录也不 stat
+    输出格式与顺序同 scan_directory；内置忽略名单照常生效
+    load_rules(相对路径) 返回该忽略文件编译后的规则：传入时与目录遍历一样读取各级 .gitignore / .ignore；
+    未传入时只从磁盘读取 .codemergerignore (git 模式：已跟踪文件不受 .gitignore 影响，与 git 一致)
+    make_record(相对路径) 生成待提取记录，默认是 root_path 下的磁盘文件
+    """
+    nested = load_rules is not None
+    if load_rules is None:
+        load_rules = lambda rel_path: load_ignore_rules(os.path.join(root_path, rel_path))
+    if make_record is None:
+        make_record = lambda rel_path: FileRecord(os.path.join(root_path, rel_path), rel_path)
+    present = set(rel_paths) if nested else None
+    chains = {}
+
+    def chain_for(prefix):
+        """prefix 目录 ("" 或 "a/b/") 下的条目适用的规则链"""
+        chain = chains.get(prefix)
+        if chain is None:
+            if prefix:
+                chain = chain_for(prefix[:prefix.rfind("/", 0, -1) + 1])
+                names = IGNORE_FILE_NAMES if nested else ()
+            else:
+                chain = ()
+                names = (IGNORE_FILE_NAMES if nested else ()) + (PROJECT_IGNORE_FILE,)
+            for name in names:
+                if present is None or prefix + name in present:
+                    rules = load_rules(prefix + name)
+                    if rules is not None:
+                        chain = chain + ((prefix, rules),)
+            chains[prefix] = chain
+        return chain
+
+    dir_ok = {}
+    tree = ({}, [])
+    for rel_path in rel_paths:
+        parts = rel_path.split("/")
+        if parts[-1] in IGNORE_FILES:
+            continue
+        prefix = ""
+        for part in parts[:-1]:
+            ok = dir_ok.get(prefix + part)
+            if ok is None:
+                chain = chain_for(prefix) if use_ignore else ()
+                ok = dir_ok[prefix + part] = part not in IGNORE_DIRS and not (chain and is_ignored(chain, prefix + part, True))
+            if not ok:
+                break
+            prefix += part + "/"
+        else:
+            chain = chain_for(prefix) if use_ignore else ()
+            if chain and is_ignored(chain, rel_path, False):
+                continue
+            node = tree
+            for part in parts[:-1]:
+                node = node[0].setdefault(part, ({}, []))
+            node[1].append(parts[-1])
+
+    tree_lines = []
+    records = []
+    _render_path_tree(tree, make_record, "", os.path.basename(os.path.normpath(root_path)), 0, tree_lines, records)
+    return "\n".join(tree_lines), records
+
+# 可直接作为导出输入 / 还原输出的归档格式
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+def is_archive_path(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+def _archive_stem(path):
+    name = os.path.basename(path)
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+class ArchiveRecord:
+    """归档中的待提取文件：stat 只提供大小，read 时才从归档取出内容"""
+    __slots__ = ("rel_path", "size", "_archive", "_name")
+
+    def __init__(self, rel_path, size, archive, name):
+        self.rel_path = rel_path
+        self.size = size
+        self._archive = archive
+        self._name = name
+
+    def stat(self):
+        return os.stat_result((0, 0, 0, 0, 0, 0, self.size, 0, 0, 0))
+
+    def read(self):
+        data = self._archive.read(self._name)
+        if looks_binary(data[:SNIFF_BYTES]):
+            raise SkipFile("疑似二进制文件", "binary")
+        return data
+
+    read_buffer = read
+
+class SourceArchive:
+    """
+    作为导出输入的 zip / tar 归档，不解压到磁盘
+    zip 可随机访问，成员内容在渲染时按需读取 (各线程可并发读取)；
+    tar (尤其是压缩的) 只能顺序读取，因此只顺序扫描一遍，把可能导出的成员 (后缀匹配或忽略文件) 的内容留在内存中
+    成员路径统一为 / 分隔；所有成员位于同一个顶层目录下时 (常见的 project-1.0/...) 以该目录作为根
+    """
+
+    def __init__(self, path, max_file_size=0):
+        self.path = path
+        self._zip = None
+        self._data = {}
+        members = []
+        if path.lower().endswith(".zip"):
+            self._zip = zipfile.ZipFile(path)
+            for info in self._zip.infolist():
+                if info.is_dir() or stat.S_ISLNK(info.external_attr >> 16):
+                    continue
+                members.append((info.filename, info.file_size))
+        else:
+            with tarfile.open(path, "r|*") as tar:
+                for member in tar:
+                    if not member.isreg():
+                        continue
+                    members.append((member.name, member.size))
+                    base = member.name.rsplit("/", 1)[-1]
+                    wanted = (base in IGNORE_FILE_NAMES or base == PROJECT_IGNORE_FILE
+                              or (base.endswith(target_extensions) and not (max_file_size and member.size > max_file_size)))
+                    if wanted:
+                        self._data[member.name] = tar.extractfile(member).read()
+
+        # 规范化路径，丢弃绝对路径与含 .. 的成员
+        self.members = {}
+        for name, size in members:
+            rel_path = "/".join(part for part in name.replace("\\", "/").split("/") if part not in ("", "."))
+            if rel_path and not name.startswith("/") and ".." not in rel_path.split("/"):
+                self.members[rel_path] = (name, size)
+        tops = {rel_path.split("/", 1)[0] for rel_path in self.members}
+        self.root_name = _archive_stem(path)
+        if len(tops) == 1 and all("/" in rel_path for rel_path in self.members):
+            self.root_name = tops.pop()
+            cut = len(self.root_name) + 1
+            self.members = {rel_path[cut:]: item for rel_path, item in self.members.items()}
+
+    def read(self, name):
+        if self._zip is not None:
+            return self._zip.read(name)
+        # 每个成员只渲染一次，取出后即释放内存
+        return self._data.pop(name)
+
+    def scan(self, use_ignore=True):
+        """生成 (目录树字符串, [ArchiveRecord, ...])，规则同目录遍历"""
+        def load_rules(rel_path):
+            name = self.members[rel_path][0]
+            data = self._zip.read(name) if self._zip is not None else self._data.get(name, b"")
+            return compile_ignore_rules(data.decode("utf-8", errors="replace").splitlines())
+
+        def make_record(rel_path):
+            name, size = self.members[rel_path]
+            return ArchiveRecord(rel_path, size, self, name)
+
+        return scan_paths(self.root_name, sorted(self.members), use_ignore, load_rules, make_record)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        self._data.clear()
+
 def get_directory_tree(root_path):
     """生成目录树结构字符串"""
-    output = []
-    base_level = root_path.rstrip(os.sep).count(os.sep)
-    
-    for root, dirs, files in os.walk(root_path):
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        dirs.sort()
-        files.sort()
-        
-        level = root.count(os.sep) - base_level
-        indent = "    " * level
-        folder_name = os.path.basename(root)
-        
-        if level == 0:
-            output.append(f"{folder_name}/")
+    return scan_directory(root_path)[0]
+
+# 一段连续反引号：找到候选段后用于量出其完整长度
+_TICK_RUN = {str: re.compile("`+"), bytes: re.compile(b"`+")}
+
+class BacktickScanner:
+    """
+    最长连续反引号扫描器：支持 str / bytes / mmap，可分块增量输入
+    块边界处的反引号串会与上一块的尾部拼接计算，分块结果与整体扫描一致
+    """
+    __slots__ = ("longest", "_tail")
+
+    def __init__(self):
+        self.longest = 0
+        self._tail = 0  # 已输入内容末尾的连续反引号数
+
+    def feed(self, chunk):
+        n = len(chunk)
+        if not n:
+            return self
+        tick = "`" if isinstance(chunk, str) else b"`"
+        run = _TICK_RUN[type(tick)]
+
+        lead = run.match(chunk)
+        lead = lead.end() if lead else 0
+        if lead == n:
+            # 整块都是反引号，继续与尾部相连
+            self._tail += n
+            self.longest = max(self.longest, self._tail)
+            return self
+        longest = max(self.longest, self._tail + lead)
+
+        # 单遍扫描：find 直接定位下一段长于当前最长值的反引号，更短的段由 C 层子串搜索整体跳过；
+        # 量出该段长度后从段尾继续，位置只增不减
+        pos = lead
+        tail = 0
+        while n - pos > longest:
+            hit = chunk.find(tick * (longest + 1), pos)
+            if hit == -1:
+                break
+            pos = run.match(chunk, hit).end()
+            longest = pos - hit
+            if pos == n:
+                tail = longest
+        self.longest = longest
+
+        # 末尾的反引号段不长于 longest (否则已在上面找到)，只需在最后 longest + 1 个字符内确定其长度
+        if not tail and chunk[n - 1:] == tick:
+            found = run.search(chunk, max(pos, n - longest - 1))
+            while found.end() != n:
+                found = run.search(chunk, found.end())
+            tail = n - found.start()
+        self._tail = tail
+        return self
+
+    def fence(self):
+        """返回能安全包裹已扫描内容的栅栏（至少 3 个反引号）"""
+        return "`" * max(3, self.longest + 1)
+
+def make_fence(content):
+    """为整段内容计算 N+1 长度的动态栅栏"""
+    return BacktickScanner().feed(content).fence()
+
+# 二进制嗅探只看文件首块
+SNIFF_BYTES = 8192
+# 文本中不应大量出现的控制字符 (保留 \t \n \r \f \b 与 ESC)
+_CONTROL_BYTES = bytes(c for c in range(32) if c not in b"\t\n\r\f\b\x1b") + b"\x7f"
+# 依次尝试的解码方式，全部失败时按 UTF-8 忽略错误解码
+SOURCE_ENCODINGS = ("utf-8", "gb18030")
+
+class SkipFile(Exception):
+    """文件被主动跳过 (疑似二进制等)，异常信息即跳过原因；reason 为 --stats 中的分类"""
+
+    def __init__(self, message, reason="skipped"):
+        super().__init__(message)
+        self.reason = reason
+
+def looks_binary(head):
+    """首块含 NUL，或控制字符占比超过 10% 时视为二进制"""
+    if b"\0" in head:
+        return True
+    control = len(head) - len(head.translate(None, _CONTROL_BYTES))
+    return control * 10 > len(head)
+
+def read_source(full_path):
+    """读取文件字节：先读首块嗅探，二进制文件不再读取剩余内容"""
+    with open(full_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+        if looks_binary(head):
+            raise SkipFile("疑似二进制文件", "binary")
+        return head + f.read()
+
+# 超过该大小的文件在字节快速路径中以只读 mmap 映射，内容直接来自页缓存，不复制到进程内存
+# (映射期间文件被其他进程截断时访问会触发 SIGBUS，因此只对大文件使用)
+MMAP_THRESHOLD = 8 * 1024 * 1024
+# 大文件分块校验 UTF-8，校验时的临时内存与文件大小无关
+VALIDATE_CHUNK = 1024 * 1024
+
+def map_source(full_path):
+    """同 read_source，但大文件返回只读 mmap 而非 bytes"""
+    with open(full_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+            head = f.read(SNIFF_BYTES)
+            if looks_binary(head):
+                raise SkipFile("疑似二进制文件", "binary")
+            return head + f.read()
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if looks_binary(data[:SNIFF_BYTES]):
+        data.close()
+        raise SkipFile("疑似二进制文件", "binary")
+    return data
+
+def is_utf8(data):
+    """校验 bytes / mmap 是否为合法 UTF-8：纯 ASCII 用 isascii 一次判断 (3.7+)，其余分块增量解码，解码结果直接丢弃"""
+    if isinstance(data, bytes) and hasattr(data, "isascii") and data.isascii():
+        return True
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with memoryview(data) as view:
+        try:
+            for start in range(0, len(view), VALIDATE_CHUNK):
+                decoder.decode(view[start:start + VALIDATE_CHUNK])
+            decoder.decode(b"", True)
+        except UnicodeDecodeError:
+            return False
+    return True
+
+def decode_source(data):
+    """
+    在内存中的字节上依次尝试候选编码，不重复读取文件；
+    并像文本模式读取那样统一换行符为 \\n
+    """
+    for encoding in SOURCE_ENCODINGS:
+        try:
+            content = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        content = data.decode("utf-8", errors="ignore")
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+def render_content(rel_path, content, fence=None):
+    """把文件内容渲染为带动态栅栏的 Markdown 代码块"""
+    # 动态栅栏长度计算
+    if fence is None:
+        fence = make_fence(content)
+
+    # 统一使用 python 标记以便高亮，第一行注释为路径
+    return f"{fence}python\n# {rel_path}\n{content}\n{fence}\n\n"
+
+# UTF-8 续字节为 0x80-0xBF，删除其余字节后剩下的长度即续字节数
+_NON_CONTINUATION = bytes(range(0x80)) + bytes(range(0xC0, 0x100))
+
+class ByteBlock:
+    """
+    字节快速路径渲染的代码块：head (栅栏 + 路径行) 与 tail (闭合栅栏) 是新生成的字节，
+    body 是文件原始字节 (bytes 或 mmap)，写出时原样交给输出流，不解码、不拼接、不重新编码
+    """
+    __slots__ = ("head", "body", "tail")
+
+    def __init__(self, head, body, tail):
+        self.head = head
+        self.body = body
+        self.tail = tail
+
+    def __len__(self):
+        return len(self.head) + len(self.body) + len(self.tail)
+
+    def char_len(self):
+        """等价 str 代码块的字符数 (UTF-8 字节数减去续字节数)，去重时用于与引用块比较长度"""
+        count = 0
+        for part in (self.head, self.tail):
+            count += len(part.translate(None, _NON_CONTINUATION))
+        with memoryview(self.body) as view:
+            for start in range(0, len(view), VALIDATE_CHUNK):
+                count += len(view[start:start + VALIDATE_CHUNK].tobytes().translate(None, _NON_CONTINUATION))
+        return len(self) - count
+
+    def digest(self):
+        """与 block_digest 对等价 str 代码块的计算结果相同"""
+        h = hashlib.sha1(self.body)
+        h.update(self.tail)
+        return h.digest()
+
+    def write_to(self, out):
+        out.write(self.head)
+        out.write(self.body)
+        out.write(self.tail)
+        return len(self)
+
+# 字节快速路径依赖输出不做换行转换；Windows 上输出的换行为 \r\n (与文本模式写入一致)，仍走 str 路径
+BYTE_OUTPUT = os.linesep == "\n"
+
+def render_bytes(record, stats=None):
+    """
+    字节快速路径：合法 UTF-8 且不含 \r 的文件不解码为 str，直接在字节上扫描反引号并组成 ByteBlock；
+    GB18030、含 \r 换行等其余文件退回 str 路径，两条路径的输出逐字节相同
+    stats 非空时按 read / decode (UTF-8 校验) / fence / render 计时
+    """
+    clock = time.perf_counter
+    start = clock()
+    data = record.read_buffer()
+    t1 = clock()
+    if data.find(b"\r") == -1 and is_utf8(data):
+        t2 = clock()
+        fence = BacktickScanner().feed(data).fence()
+        t3 = clock()
+        block = ByteBlock(f"{fence}python\n# {record.rel_path}\n".encode("utf-8"), data,
+                          f"\n{fence}\n\n".encode("ascii"))
+    else:
+        if isinstance(data, mmap.mmap):
+            with data:
+                data = data[:]
+        content = decode_source(data)
+        t2 = clock()
+        fence = make_fence(content)
+        t3 = clock()
+        block = render_content(record.rel_path, content, fence)
+    if stats is not None:
+        t4 = clock()
+        stats.add("read", t1 - start)
+        stats.add("decode", t2 - t1)
+        stats.add("fence", t3 - t2)
+        stats.add("render", t4 - t3)
+        stats.count("bytes_read", len(data))
+        stats.file_done(record.rel_path, t4 - start)
+    return block
+
+def write_block(out, block):
+    """把代码块写入二进制输出流：ByteBlock 逐段写出，str 与文本模式写入等价地编码；返回写入的字节数"""
+    if isinstance(block, ByteBlock):
+        return block.write_to(out)
+    data = encode_for_disk(block)
+    out.write(data)
+    return len(data)
+
+# 引用块的语言标记：正文是内容相同的首个文件的相对路径，还原时复制 / 链接该文件
+REF_LANG = "ref"
+
+def render_ref(rel_path, source_path):
+    """渲染引用块：rel_path 的内容与之前导出的 source_path 完全相同"""
+    fence = make_fence(source_path)
+    return f"{fence}{REF_LANG}\n# {rel_path}\n{source_path}\n{fence}\n\n"
+
+def block_digest(block):
+    """代码块正文 (文件内容 + 闭合栅栏) 的哈希；跳过栅栏行与路径行，语言标记与路径不同不影响结果"""
+    if isinstance(block, ByteBlock):
+        return block.digest()
+    start = block.index("\n", block.index("\n") + 1) + 1
+    return hashlib.sha1(block[start:].encode("utf-8")).digest()
+
+# 删除列表块的语言标记：正文每行一个已删除的相对路径
+DELETE_LANG = "delete"
+
+def render_delete(rel_paths):
+    """渲染增量导出的删除列表块"""
+    body = "\n".join(rel_paths)
+    fence = make_fence(body)
+    return f"{fence}{DELETE_LANG}\n# deleted\n{body}\n{fence}\n\n"
+
+MANIFEST_FORMAT = "cli-manifest-1"
+
+def load_manifest(path):
+    """读取导出清单，返回 {相对路径: 正文哈希 (hex)}"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("format") != MANIFEST_FORMAT:
+        raise ValueError(f"不支持的清单格式: {data.get('format')}")
+    return data["files"]
+
+def save_manifest(path, source_dir, files):
+    data = {"format": MANIFEST_FORMAT, "source": os.path.abspath(source_dir), "files": files}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def git_changes(source_dir, revision):
+    """
+    相对 git 版本 revision 的改动：返回 (新增或修改的路径集合, 已删除的路径列表)，路径相对 source_dir
+    包含工作区中尚未提交的修改以及未跟踪且未被忽略的文件；无法获取时返回 None
+    """
+    try:
+        diff = subprocess.run(["git", "diff", "--name-status", "-z", "--no-renames", "--relative", revision, "--"],
+                              cwd=source_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        others = subprocess.run(["git", "ls-files", "-z", "--others", "--exclude-standard"],
+                                cwd=source_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    changed, deleted = set(), []
+    fields = diff.split(b"\0")
+    # -z 输出为 "状态\0路径\0" 交替排列
+    for status, path in zip(fields[::2], fields[1::2]):
+        if status.startswith(b"D"):
+            deleted.append(os.fsdecode(path))
         else:
-            output.append(f"{indent}|-- {folder_name}/")
-            
-        sub_indent = "    " * (level + 1)
-        for f in files:
-            if f not in IGNORE_FILES:
-                output.append(f"{sub_indent}|-- {f}")
-                
-    return "\n".join(output)
+            changed.add(os.fsdecode(path))
+    changed.update(os.fsdecode(p) for p in others.split(b"\0") if p)
+    return changed, sorted(deleted)
+
+class BlockDeduper:
+    """
+    导出去重：按代码块正文 (文件内容 + 闭合栅栏) 的哈希记住首次出现的路径，
+    之后内容相同的文件改为输出引用块；引用块不比原代码块短时 (如空文件) 仍输出原块
+    """
+
+    def __init__(self):
+        self.first = {}
+        self.files = 0
+        self.saved_chars = 0
+
+    def apply(self, rel_path, block):
+        source = self.source(rel_path, block_digest(block))
+        if source is None:
+            return block
+        ref = self.ref(rel_path, source, block.char_len() if isinstance(block, ByteBlock) else len(block))
+        return block if ref is None else ref
+
+    def source(self, rel_path, digest):
+        """登记正文哈希；之前已有内容相同的文件时返回其路径，否则返回 None"""
+        source = self.first.setdefault(digest, rel_path)
+        return None if source == rel_path else source
+
+    def ref(self, rel_path, source, size):
+        """代替 size 个字符的代码块的引用块；引用块不比原块短时返回 None"""
+        ref = render_ref(rel_path, source)
+        if len(ref) >= size:
+            return None
+        self.files += 1
+        self.saved_chars += size - len(ref)
+        return ref
+
+# 渲染格式版本：渲染逻辑变化时递增，使旧的缓存条目失效
+CACHE_FORMAT = "cli-2"
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+
+def default_cache_dir():
+    """用户缓存目录：Windows 用 %LOCALAPPDATA%，其余平台遵循 XDG_CACHE_HOME"""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "code_merger")
+
+class ExportCache:
+    """
+    导出缓存：以 (源目录, 相对路径, 渲染格式) 为键保存渲染好的代码块
+    size + mtime 一致即命中；开启 verify_hash 时，mtime 变化但内容哈希一致也视为命中
+    关闭时按最近使用时间淘汰，使缓存总大小不超过 max_bytes
+    """
+
+    def __init__(self, cache_dir, source_dir, max_bytes=DEFAULT_CACHE_SIZE, verify_hash=False):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.root = os.path.abspath(source_dir)
+        self.max_bytes = max_bytes
+        self.verify_hash = verify_hash
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._used = []
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "blocks.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blocks ("
+            " root TEXT, rel_path TEXT, fmt TEXT, size INTEGER, mtime_ns INTEGER,"
+            " digest TEXT, block TEXT, nbytes INTEGER, last_used REAL,"
+            " PRIMARY KEY (root, rel_path, fmt))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blocks_lru ON blocks (last_used)")
+        # 一次性载入本目录的元数据，逐文件判断时无需查库
+        self._meta = {
+            rel_path: (rowid, size, mtime_ns, digest)
+            for rowid, rel_path, size, mtime_ns, digest in self._conn.execute(
+                "SELECT rowid, rel_path, size, mtime_ns, digest FROM blocks WHERE root = ? AND fmt = ?",
+                (self.root, CACHE_FORMAT),
+            )
+        }
+
+    def lookup(self, record, st):
+        """命中时返回缓存的代码块，否则返回 None"""
+        meta = self._meta.get(record.rel_path)
+        if meta is None:
+            return None
+        rowid, size, mtime_ns, digest = meta
+        if size != st.st_size:
+            return None
+        if mtime_ns != st.st_mtime_ns:
+            if not (self.verify_hash and digest):
+                return None
+            with open(record.path, "rb") as f:
+                if hashlib.sha1(f.read()).hexdigest() != digest:
+                    return None
+            with self._lock:
+                self._conn.execute("UPDATE blocks SET mtime_ns = ? WHERE rowid = ?", (st.st_mtime_ns, rowid))
+        with self._lock:
+            row = self._conn.execute("SELECT block FROM blocks WHERE rowid = ?", (rowid,)).fetchone()
+            if row is None:
+                return None
+            self._used.append(rowid)
+            self.hits += 1
+        return row[0]
+
+    def store(self, record, st, data, block):
+        digest = hashlib.sha1(data).hexdigest() if self.verify_hash else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.root, record.rel_path, CACHE_FORMAT, st.st_size, st.st_mtime_ns,
+                 digest, block, len(block.encode("utf-8")), time.time()),
+            )
+
+    def close(self):
+        """写回命中时间并按 LRU 淘汰超出容量的条目"""
+        with self._lock:
+            now = time.time()
+            self._conn.executemany("UPDATE blocks SET last_used = ? WHERE rowid = ?",
+                                   ((now, rowid) for rowid in self._used))
+            total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM blocks").fetchone()[0]
+            if total > self.max_bytes:
+                evict = []
+                for rowid, nbytes in self._conn.execute("SELECT rowid, nbytes FROM blocks ORDER BY last_used"):
+                    if total <= self.max_bytes:
+                        break
+                    evict.append((rowid,))
+                    total -= nbytes
+                self._conn.executemany("DELETE FROM blocks WHERE rowid = ?", evict)
+            self._conn.commit()
+            self._conn.close()
+
+def make_timed_renderer(stats, cache=None):
+    """--stats 使用的渲染函数：与 make_renderer 逻辑相同，逐阶段计时"""
+    clock = time.perf_counter
+
+    def render(record):
+        start = clock()
+        if cache is not None:
+            st = record.stat()
+            block = cache.lookup(record, st)
+            now = clock()
+            stats.add("cache", now - start)
+            if block is not None:
+                stats.file_done(record.rel_path, now - start)
+                return block
+        t0 = clock()
+        data = record.read()
+        t1 = clock()
+        content = decode_source(data)
+        t2 = clock()
+        fence = make_fence(content)
+        t3 = clock()
+        block = render_content(record.rel_path, content, fence)
+        t4 = clock()
+        if cache is not None:
+            cache.store(record, st, data, block)
+            stats.add("cache", clock() - t4)
+        stats.add("read", t1 - t0)
+        stats.add("decode", t2 - t1)
+        stats.add("fence", t3 - t2)
+        stats.add("render", t4 - t3)
+        stats.count("bytes_read", len(data))
+        stats.file_done(record.rel_path, clock() - start)
+        return block
+    return render
+
+def make_renderer(cache=None, stats=None, fast=False):
+    """
+    返回 record -> 代码块 的渲染函数；传入缓存时先查缓存，未命中再读取文件
+    fast 为 True (且不使用缓存) 时走字节快速路径，代码块可能是 ByteBlock，需用 write_block 写入输出
+    """
+    if fast and cache is None:
+        return lambda record: render_bytes(record, stats)
+    if stats is not None:
+        return make_timed_renderer(stats, cache)
+    if cache is None:
+        return lambda record: render_content(record.rel_path, decode_source(record.read()))
+
+    def render(record):
+        st = record.stat()
+        block = cache.lookup(record, st)
+        if block is None:
+            data = record.read()
+            block = render_content(record.rel_path, decode_source(data))
+            cache.store(record, st, data, block)
+        return block
+    return render
+
+def _resolve(record, future):
+    try:
+        return record, future.result(), None
+    except Exception as e:
+        return record, None, e
+
+def iter_rendered_blocks(records, jobs=1, render=None):
+    """
+    按 records 原有顺序产出 (record, block, error)，render 默认直接读取文件渲染
+    jobs > 1 时使用线程池并发读取/解码/计算栅栏；滑动窗口限制在途任务数，
+    既保证输出顺序与顺序执行完全一致，也保证内存有界
+    """
+    if render is None:
+        render = make_renderer()
+
+    if jobs <= 1:
+        for record in records:
+            try:
+                yield record, render(record), None
+            except Exception as e:
+                yield record, None, e
+        return
+
+    window = jobs * 4
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for record in records:
+            pending.append((record, pool.submit(render, record)))
+            if len(pending) >= window:
+                yield _resolve(*pending.popleft())
+        while pending:
+            yield _resolve(*pending.popleft())
 
-def export_to_markdown(source_dir, output_file):
+def limit_records(records, max_file_size=0, max_total_size=0, stats=None):
+    """按 stat 大小提前跳过超出单文件上限或总量上限的文件，不读取其内容"""
+    total = 0
+    for record in records:
+        try:
+            size = record.stat().st_size
+        except OSError:
+            # 交给渲染阶段报告错误
+            yield record
+            continue
+        if max_file_size and size > max_file_size:
+            log(f"跳过文件 {record.rel_path}: 超出单文件大小上限 ({size} 字节)")
+            if stats is not None:
+                stats.skip("max_file_size")
+            continue
+        if max_total_size and total + size > max_total_size:
+            log(f"跳过文件 {record.rel_path}: 超出总大小上限 ({size} 字节)")
+            if stats is not None:
+                stats.skip("max_total_size")
+            continue
+        total += size
+        yield record
+
+def estimate_tokens(text, nbytes=None):
+    """
+    粗略估算 token 数：ASCII 约 4 字符 1 个 token，CJK 等多字节字符约 1 字符 1 个 token
+    只用到字符数与 UTF-8 字节数，不做分词
+    """
+    if nbytes is None:
+        nbytes = len(text.encode("utf-8"))
+    chars = len(text)
+    wide = (nbytes - chars) // 2  # 三字节字符数的近似值
+    return (chars - wide) // 4 + wide
+
+def shard_path(output_file, index):
+    """project.md -> project.part001.md"""
+    base, ext = os.path.splitext(output_file)
+    return f"{base}.part{index:03d}{ext or '.md'}"
+
+class ShardWriter:
+    """
+    分片输出：按字节 / 行数 / 估算 token 预算把代码块写入编号分片
+    每个分片都带目录树头部；代码块不会跨分片，单个文件超出预算时独占一个分片
+    """
+
+    def __init__(self, output_file, header, max_bytes=0, max_lines=0, max_tokens=0):
+        self.output_file = output_file
+        self.header = header
+        self.budget = (max_bytes or 0, max_lines or 0, max_tokens or 0)
+        self.paths = []
+        self._out = None
+        self._used = None
+        self._blocks = 0
+
+    @staticmethod
+    def _cost(text):
+        nbytes = len(text.encode("utf-8"))
+        return (nbytes, text.count("\n"), estimate_tokens(text, nbytes))
+
+    def _over(self, cost):
+        return any(limit and used + c > limit for used, c, limit in zip(self._used, cost, self.budget))
+
+    def _open_next(self):
+        self.close()
+        path = shard_path(self.output_file, len(self.paths) + 1)
+        self._out = open(path, "w", encoding="utf-8")
+        self.paths.append(path)
+        self._out.write(self.header)
+        self._used = self._cost(self.header)
+        self._blocks = 0
+
+    def write(self, block, rel_path=""):
+        cost = self._cost(block)
+        if self._out is None or (self._blocks and self._over(cost)):
+            self._open_next()
+        if self._over(cost):
+            log(f"警告: {rel_path} 单个文件超出分片预算，独占分片 {self.paths[-1]}")
+        self._out.write(block)
+        self._used = tuple(u + c for u, c in zip(self._used, cost))
+        self._blocks += 1
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+def export_to_markdown(source_dir, output_file, jobs=1, cache_dir=None,
+                       cache_size=DEFAULT_CACHE_SIZE, cache_verify=False,
+                       max_bytes=0, max_lines=0, max_tokens=0,
+                       max_file_size=0, max_total_size=0, use_ignore=True, git_mode=None, dedup=False,
+                       since=None, manifest_path=None, build_index=False, stats=None):
     """
     导出模式：遍历目录生成 Markdown
     核心逻辑：检测文件内容中的反引号数量，动态生成 N+1 长度的栅栏
+    流式写出：每个文件渲染完立即写入输出，内存峰值只与最大单文件相关
+    output_file 为 "-" 时写入 stdout，可直接管道给其他进程
+    jobs > 1 时并发读取文件，输出顺序不变
+    cache_dir 非空时启用导出缓存，未变化的文件只需一次 stat
+    设置 max_bytes / max_lines / max_tokens 任一预算时输出为编号分片 (project.part001.md ...)
+    max_file_size / max_total_size (字节) 按 stat 大小提前跳过超限文件；疑似二进制的文件同样跳过
+    use_ignore 为 True 时遵循 .gitignore / .ignore / .codemergerignore，被忽略的目录不会被遍历
+    git_mode 为 tracked / all 时从 git 索引获取文件列表，不遍历目录
+    source_dir 为 zip / tar 归档时直接从归档读取，不解压到磁盘 (此时不使用缓存与 git_mode)
+    dedup 为 True 时内容相同的文件只输出一次，之后的副本输出为指向首个文件的引用块
+    since 非空时为增量导出：since 是之前导出的清单文件或 git 版本，只输出新增/修改的文件，
+    目录树仍是完整的，已删除的路径在末尾以删除列表块列出
+    manifest_path 非空时把本次导出各文件的正文哈希写入清单，供之后的增量导出对比
+    build_index 为 True 时在输出文件旁写入块索引 (各代码块的路径、栅栏与正文字节范围)，供选择性还原直接定位
+    stats 为 Stats 实例时记录各阶段耗时与计数
     """
+    global _log_stream
     if not os.path.exists(source_dir):
-        print(f"错误: 目录不存在 {source_dir}")
+        print(f"错误: 目录不存在 {source_dir}", file=sys.stderr)
         sys.exit(1)
+    archive = None
+    from_archive = os.path.isfile(source_dir) and is_archive_path(source_dir)
+    if from_archive:
+        if cache_dir or git_mode:
+            log("输入为归档文件，忽略 --cache / --git 选项")
+        cache_dir = git_mode = None
 
-    result_content = []
-    
-    # 1. 添加目录树
-    print("正在生成目录树...")
-    tree_str = get_directory_tree(source_dir)
-    result_content.append("## Project Structure\n")
-    result_content.append("```text")
-    result_content.append(tree_str)
-    result_content.append("```\n\n")
-    
-    # 2. 遍历文件内容
-    print("正在提取文件内容...")
-    result_content.append("## Code Contents\n\n")
-    
-    file_count = 0
-    for root, dirs, files in os.walk(source_dir):
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        dirs.sort()
-        files.sort()
-        
-        for file in files:
-            if file.endswith(target_extensions) and file not in IGNORE_FILES:
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(full_path, source_dir).replace("\\", "/")
-                
-                try:
-                    with open(full_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-                    
-                    # 动态栅栏长度计算
-                    ticks = re.findall(r'`+', content)
-                    max_ticks = max(len(t) for t in ticks) if ticks else 0
-                    fence_len = max(3, max_ticks + 1)
-                    fence = "`" * fence_len
-                    
-                    # 统一使用 python 标记以便高亮，第一行注释为路径
-                    block = f"{fence}python\n# {rel_path}\n{content}\n{fence}\n\n"
-                    result_content.append(block)
-                    file_count += 1
-                    print(f"已处理: {rel_path}")
-                except Exception as e:
-                    print(f"跳过文件 {rel_path}: {e}")
-
-    # 写入最终文件
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write("".join(result_content))
-    
-    print(f"\n导出完成! 共处理 {file_count} 个文件。")
-    print(f"输出文件: {os.path.abspath(output_file)}")
+    to_stdout = output_file == "-"
+    if to_stdout:
+        # 遍历阶段的进度信息同样不能混入 stdout
+        _log_stream = sys.stderr
+    sharded = bool(max_bytes or max_lines or max_tokens)
+    if sharded and to_stdout:
+        print("错误: 分片导出不支持输出到 stdout", file=sys.stderr)
+        sys.exit(1)
 
-def restore_from_markdown(md_file, target_dir):
+    # 增量导出的基准：清单文件 或 git 版本
+    baseline = git_changed = None
+    if since:
+        if os.path.isfile(since):
+            try:
+                baseline = load_manifest(since)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"错误: 无法读取清单 {since}: {e}", file=sys.stderr)
+                sys.exit(1)
+        else:
+            changes = None if from_archive else git_changes(source_dir, since)
+            if changes is None:
+                print(f"错误: {since} 既不是清单文件，也不是可用的 git 版本", file=sys.stderr)
+                sys.exit(1)
+            git_changed, git_deleted = changes
+
+    # 1. 单次遍历：目录树与文件列表一起生成
+    walk_start = time.perf_counter()
+    git_paths = None
+    if git_mode:
+        git_paths = list_git_files(source_dir, git_mode)
+        if git_paths is None:
+            log("无法获取 git 文件列表，改为遍历目录")
+    if from_archive:
+        log("正在读取归档...")
+        try:
+            archive = SourceArchive(source_dir, max_file_size)
+        except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+            print(f"错误: 无法读取归档 {source_dir}: {e}", file=sys.stderr)
+            sys.exit(1)
+        tree_str, records = archive.scan(use_ignore)
+    elif git_paths is not None:
+        log(f"正在读取 git 文件列表... ({len(git_paths)} 个)")
+        tree_str, records = scan_paths(source_dir, git_paths, use_ignore)
+    else:
+        log("正在扫描目录...")
+        tree_str, records = scan_directory(source_dir, use_ignore)
+    if stats is not None:
+        stats.add("walk", time.perf_counter() - walk_start)
+    deleted = []
+    skipped_unchanged = 0
+    if since:
+        present = {record.rel_path for record in records}
+        if baseline is not None:
+            deleted = sorted(rel_path for rel_path in baseline if rel_path not in present)
+        else:
+            deleted = [rel_path for rel_path in git_deleted
+                       if rel_path not in present and rel_path.endswith(target_extensions)]
+            if manifest_path is None:
+                # 不需要写清单时，未改动的文件不必读取
+                changed_records = [record for record in records if record.rel_path in git_changed]
+                skipped_unchanged = len(records) - len(changed_records)
+                records = changed_records
+    if max_file_size or max_total_size:
+        records = limit_records(records, max_file_size, max_total_size, stats)
+    header = f"## Project Structure\n```text\n{tree_str}\n```\n\n## Code Contents\n\n"
+
+    # 单文件输出且不使用缓存时走字节快速路径 (缓存与分片都以 str 代码块为单位)
+    fast = BYTE_OUTPUT and not sharded and not cache_dir
+    index = None
+    if build_index:
+        if sharded or to_stdout:
+            log("分片导出或输出到 stdout 时不生成块索引，还原时将预扫描")
+        else:
+            index = []
+    if sharded:
+        writer = ShardWriter(output_file, header, max_bytes, max_lines, max_tokens)
+        output_cm = contextlib.closing(writer)
+    else:
+        output_cm = open_output(output_file)
+
+    with output_cm as out:
+        offset = 0
+        if not sharded:
+            offset = write_block(out, header)
+
+        # 2. 提取文件内容
+        log("正在提取文件内容...")
+
+        cache = ExportCache(cache_dir, source_dir, cache_size, cache_verify) if cache_dir else None
+        deduper = BlockDeduper() if dedup else None
+        manifest = {} if manifest_path else None
+        file_count = 0
+        unchanged_count = skipped_unchanged
+        try:
+            render = make_renderer(cache, stats, fast)
+            for record, block, error in iter_rendered_blocks(records, jobs, render):
+                if error is not None:
+                    log(f"跳过文件 {record.rel_path}: {error}")
+                    if stats is not None:
+                        stats.skip(getattr(error, "reason", type(error).__name__))
+                    continue
+
+                if manifest is not None or baseline is not None:
+                    digest = block_digest(block).hex()
+                    if manifest is not None:
+                        manifest[record.rel_path] = digest
+                    if baseline is not None and baseline.get(record.rel_path) == digest:
+                        unchanged_count += 1
+                        continue
+                if git_changed is not None and record.rel_path not in git_changed:
+                    unchanged_count += 1
+                    continue
+                if deduper is not None:
+                    if stats is not None:
+                        dedup_start = time.perf_counter()
+                    block = deduper.apply(record.rel_path, block)
+                    if stats is not None:
+                        stats.add("dedup", time.perf_counter() - dedup_start)
+                if stats is not None:
+                    write_start = time.perf_counter()
+                if sharded:
+                    out.write(block, record.rel_path)
+                    nbytes = len(block.encode("utf-8")) if stats is not None else 0
+                else:
+                    nbytes = write_block(out, block)
+                    if index is not None:
+                        index.append(index_entry(block, offset, nbytes))
+                    offset += nbytes
+                if to_stdout:
+                    # 管道下游需要尽快拿到数据
+                    out.flush()
+                if stats is not None:
+                    stats.add("write", time.perf_counter() - write_start)
+                    stats.count("bytes_written", nbytes)
+                file_count += 1
+                log(f"已处理: {record.rel_path}")
+
+            if deleted:
+                block = render_delete(deleted)
+                if sharded:
+                    out.write(block, "deleted")
+                else:
+                    nbytes = write_block(out, block)
+                    if index is not None:
+                        index.append(index_entry(block, offset, nbytes))
+        finally:
+            if cache is not None:
+                cache.close()
+            if archive is not None:
+                archive.close()
+
+    if index is not None:
+        save_block_index(output_file, index)
+    log(f"\n导出完成! 共处理 {file_count} 个文件。")
+    if since:
+        log(f"增量导出: 未变化 {unchanged_count} 个, 已删除 {len(deleted)} 个")
+    if manifest is not None:
+        save_manifest(manifest_path, source_dir, manifest)
+        log(f"导出清单: {os.path.abspath(manifest_path)}")
+    if deduper is not None:
+        log(f"内容去重: {deduper.files} 个文件输出为引用块，节省 {deduper.saved_chars} 字符")
+    if cache is not None:
+        log(f"缓存命中: {cache.hits} 个文件")
+    if sharded:
+        log(f"输出分片: {len(writer.paths)} 个")
+        for path in writer.paths:
+            log(f"  {os.path.abspath(path)}")
+    else:
+        log(f"输出文件: {'<stdout>' if to_stdout else os.path.abspath(output_file)}")
+    if index is not None:
+        log(f"块索引: {os.path.abspath(index_path(output_file))}")
+    if stats is not None:
+        stats.count("files", file_count)
+        stats.count("bytes_written", len(header.encode("utf-8")) * (len(writer.paths) if sharded else 1))
+        if cache is not None:
+            stats.count("cache_hits", cache.hits)
+        if since:
+            stats.count("delta_unchanged", unchanged_count)
+            stats.count("delta_deleted", len(deleted))
+        if deduper is not None:
+            stats.count("dedup_files", deduper.files)
+            stats.count("dedup_saved_chars", deduper.saved_chars)
+        stats.print_summary()
+    _log_stream = None
+
+# inotify 事件掩码 (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONTFOLLOW = 0x02000000
+_IN_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+                  | IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONTFOLLOW)
+_IN_STRUCTURE = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_IN_EVENT = struct.Struct("iIII")
+
+class Inotify:
+    """通过 ctypes 调用 libc 的 inotify 接口 (零依赖)；非 Linux 或接口不可用时构造时抛出 OSError"""
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify 仅在 Linux 上可用")
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._ctypes = ctypes
+        self._libc = libc
+        self.fd = fd
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _IN_WATCH_MASK)
+        if wd < 0:
+            errno = self._ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """等待至多 timeout 秒 (None 为一直等待)，返回 [(wd, mask, name), ...]"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        events = []
+        while ready:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _IN_EVENT.unpack_from(data, offset)
+                offset += _IN_EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def _parent_prefix(rel_path):
+    """"a/b/" 或 "a/b/c.py" 所在目录的前缀 ("a/" 或 "a/b/")"""
+    return rel_path[:rel_path.rfind("/", 0, len(rel_path) - 1) + 1]
+
+class ExportWatcher:
     """
-    还原模式：解析 Markdown 写入文件
-    核心逻辑：状态机解析，严格匹配栅栏长度，防止嵌套截断
+    --watch 模式：首次导出后持续监视源目录，输出文件始终与源目录保持一致
+    内存中保存目录模型 (每个目录的子目录与文件名)，以及各文件代码块的哈希与其在输出文件中的位置：
+    文件内容变化只重新渲染该文件；增删文件只重新列出所在目录；忽略文件变化时才重新完整遍历
+    有 inotify 时按事件更新，否则每隔 interval 秒比较 stat 快照
+    输出文件每次整体重写 (临时文件 + rename)：新渲染的代码块逐个写出，未变化的代码块从上一次的输出文件中原样复制，
+    读取与渲染只发生在变化的文件上，常驻内存不随输出大小增长
     """
-    if not os.path.exists(md_file):
-        print(f"错误: MD文件不存在 {md_file}")
+    # 一次保存往往产生一串事件：收到第一个事件后再等这么久，合并为一轮处理
+    DEBOUNCE = 0.1
+
+    def __init__(self, source_dir, output_file, jobs=1, cache=None, use_ignore=True,
+                 max_file_size=0, max_total_size=0, dedup=False, interval=1.0):
+        self.root = source_dir
+        self.output_file = output_file
+        self.jobs = jobs
+        self.render = make_renderer(cache)
+        self.use_ignore = use_ignore
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+        self.dedup = dedup
+        self.interval = interval
+        # 输出文件位于源目录中时不能把它自己列入模型，否则每次写出都会触发下一轮
+        rel_output = os.path.relpath(os.path.abspath(output_file), os.path.abspath(source_dir))
+        self.skip_rel = None if rel_output.startswith("..") else rel_output.replace(os.sep, "/")
+        self.output_stat = None  # 上一次写出的输出文件 (size, mtime_ns, ino)，未被改动时才从中复制代码块
+        self.inotify = None
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            log(f"inotify 不可用 ({e})，改为每 {interval} 秒轮询")
+        self._reset()
+
+    def _reset(self):
+        if self.inotify is not None:
+            for wd in getattr(self, "wds", {}):
+                self.inotify.rm_watch(wd)
+        self.nodes = {}       # 目录前缀 -> ({子目录名: 节点}, [文件名])
+        self.chains = {}      # 目录前缀 -> 该目录的忽略规则链
+        self.dir_mtimes = {}  # 目录前缀 -> mtime_ns (轮询用)
+        self.files = {}       # 相对路径 -> (size, mtime_ns, ino)，用于判断文件是否变化
+        self.blocks = {}      # 相对路径 -> [正文哈希, 字符数, 在输出文件中的偏移, 字节数]；没有代码块 (二进制等) 时为 None
+        self.fresh = {}       # 相对路径 -> 本轮新渲染、尚未写出的代码块
+        self.wds = {}         # inotify wd -> 目录前缀
+        self._tree = None
+
+    def _dir_path(self, rel_prefix):
+        return os.path.join(self.root, rel_prefix) if rel_prefix else self.root
+
+    def _root_chain(self):
+        return () if self.use_ignore else None
+
+    def _wanted(self, rel_path):
+        name = rel_path.rsplit("/", 1)[-1]
+        return rel_path != self.skip_rel and not (name.startswith(".cm-") and name.endswith(".tmp"))
+
+    def _walk(self, rel_prefix, parent_chain, touched):
+        """列出目录及其全部子目录并登记到模型，其中的文件加入 touched 待渲染；目录无法读取时返回 None"""
+        dir_path = self._dir_path(rel_prefix)
+        # 先开始监视 / 记录 mtime 再列目录，列目录期间发生的变化不会漏掉
+        try:
+            self.dir_mtimes[rel_prefix] = os.stat(dir_path).st_mtime_ns
+            if self.inotify is not None:
+                self.wds[self.inotify.add_watch(dir_path)] = rel_prefix
+        except OSError as e:
+            log(f"无法监视目录 {dir_path}: {e}")
+        listing = list_dir(dir_path, rel_prefix, parent_chain)
+        if listing is None:
+            self.dir_mtimes.pop(rel_prefix, None)
+            return None
+        dirs, files, chain = listing
+        node = ({}, [])
+        self.nodes[rel_prefix] = node
+        self.chains[rel_prefix] = chain
+        for entry in files:
+            rel_path = rel_prefix + entry.name
+            if self._wanted(rel_path):
+                node[1].append(entry.name)
+                self._add_file(rel_path, touched)
+        for entry in dirs:
+            child = self._walk(rel_prefix + entry.name + "/", chain, touched)
+            if child is not None:
+                node[0][entry.name] = child
+        return node
+
+    def _snapshot(self, rel_path):
+        """文件的 (size, mtime_ns, ino)；包含 inode，rename 覆盖保存 (大小与 mtime 可能不变) 也能识别"""
+        try:
+            st = os.stat(os.path.join(self.root, rel_path))
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def _add_file(self, rel_path, touched):
+        self.files[rel_path] = self._snapshot(rel_path) or (0, 0, 0)
+        touched.add(rel_path)
+
+    def _drop(self, rel_prefix):
+        """从模型中移除整个子目录"""
+        for prefix in [p for p in self.nodes if p.startswith(rel_prefix)]:
+            del self.nodes[prefix]
+            self.chains.pop(prefix, None)
+            self.dir_mtimes.pop(prefix, None)
+        for wd in [wd for wd, p in self.wds.items() if p.startswith(rel_prefix)]:
+            del self.wds[wd]
+            self.inotify.rm_watch(wd)
+        for rel_path in [p for p in self.files if p.startswith(rel_prefix)]:
+            del self.files[rel_path]
+            self._forget(rel_path)
+
+    def _forget(self, rel_path):
+        self.blocks.pop(rel_path, None)
+        self.fresh.pop(rel_path, None)
+
+    def _rescan_dir(self, rel_prefix, touched):
+        """重新列出单个目录，把增删的文件与子目录同步到模型；返回目录结构是否有变化"""
+        node = self.nodes.get(rel_prefix)
+        if node is None:
+            return False
+        parent_chain = self.chains.get(_parent_prefix(rel_prefix)) if rel_prefix else self._root_chain()
+        dir_path = self._dir_path(rel_prefix)
+        try:
+            self.dir_mtimes[rel_prefix] = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            pass
+        listing = list_dir(dir_path, rel_prefix, parent_chain)
+        if listing is None:
+            # 目录本身已被删除，由上级目录的变化处理
+            return False
+        dirs, files, _ = listing
+        names = [e.name for e in files if self._wanted(rel_prefix + e.name)]
+        dir_names = {e.name for e in dirs}
+        old_names = set(node[1])
+        # 编辑器、sed -i、git checkout 常以 "写临时文件 + rename 覆盖" 保存：文件名不变，只能靠 stat 发现
+        for name in old_names.intersection(names):
+            rel_path = rel_prefix + name
+            if self._snapshot(rel_path) != self.files.get(rel_path):
+                touched.add(rel_path)
+        if names == node[1] and dir_names == node[0].keys():
+            return False
+        for name in old_names.difference(names):
+            self.files.pop(rel_prefix + name, None)
+            self._forget(rel_prefix + name)
+        for name in names:
+            if name not in old_names:
+                self._add_file(rel_prefix + name, touched)
+        node[1][:] = names
+        for name in list(node[0]):
+            if name not in dir_names:
+                self._drop(rel_prefix + name + "/")
+                del node[0][name]
+        for name in sorted(dir_names.difference(node[0])):
+            child = self._walk(rel_prefix + name + "/", self.chains[rel_prefix], touched)
+            if child is not None:
+                node[0][name] = child
+        self._tree = None
+        return True
+
+    def _render(self, rel_paths):
+        """重新渲染给定文件，返回代码块有变化的文件数"""
+        records = []
+        changed = 0
+        for rel_path in sorted(rel_paths):
+            if rel_path not in self.files:
+                continue
+            # 读取前刷新快照，否则轮询时同一文件每一轮都会被当作已变化
+            snapshot = self._snapshot(rel_path)
+            if snapshot is None:
+                # 已被删除，由所在目录的变化处理
+                continue
+            self.files[rel_path] = snapshot
+            if not rel_path.endswith(target_extensions):
+                continue
+            size = snapshot[0]
+            if self.max_file_size and size > self.max_file_size:
+                if self._store(rel_path, None):
+                    changed += 1
+                continue
+            records.append(FileRecord(os.path.join(self.root, rel_path), rel_path))
+        for record, block, error in iter_rendered_blocks(records, self.jobs, self.render):
+            if error is not None:
+                log(f"跳过文件 {record.rel_path}: {error}")
+            if self._store(record.rel_path, block):
+                changed += 1
+        return changed
+
+    def _store(self, rel_path, block):
+        """记录新渲染的代码块 (暂存到下一次写出)，返回与上一次的结果是否不同"""
+        digest = None if block is None else block_digest(block)
+        if rel_path in self.blocks:
+            old = self.blocks[rel_path]
+            if (None if old is None else old[0]) == digest:
+                return False
+        if block is None:
+            self.blocks[rel_path] = None
+            self.fresh.pop(rel_path, None)
+        else:
+            self.blocks[rel_path] = [digest, len(block), None, 0]
+            self.fresh[rel_path] = block
+        return True
+
+    def _render_one(self, rel_path):
+        try:
+            block = self.render(FileRecord(os.path.join(self.root, rel_path), rel_path))
+        except Exception as e:
+            log(f"跳过文件 {rel_path}: {e}")
+            block = None
+        self.blocks[rel_path] = None if block is None else [block_digest(block), len(block), None, 0]
+        return block
+
+    def _open_previous(self):
+        """打开上一次写出的输出文件；已不存在或被其他程序改动时返回 None，其中的代码块改为重新渲染"""
+        if self.output_stat is None:
+            return None
+        try:
+            f = open(self.output_file, "rb")
+        except OSError:
+            return None
+        st = os.fstat(f.fileno())
+        if (st.st_size, st.st_mtime_ns, st.st_ino) != self.output_stat:
+            f.close()
+            return None
+        return f
+
+    def _write(self):
+        """整体重写输出文件，返回写出的代码块数"""
+        if self._tree is None:
+            tree_lines, order = [], []
+            _render_path_tree(self.nodes[""], lambda rel_path: rel_path, "",
+                              os.path.basename(os.path.normpath(self.root)), 0, tree_lines, order)
+            self._tree = ("\n".join(tree_lines), order)
+        tree_str, order = self._tree
+        prev = self._open_previous()
+        # 先按输出顺序确定要写出的文件：尚未渲染过的文件在写出时按顺序并发渲染；
+        # 渲染过但不在上一次输出中的 (去重时多为引用块) 先看本次是否仍输出引用块，需要原块时才单独重新渲染
+        plan, records = [], []
+        total = 0
+        for rel_path in order:
+            size = self.files.get(rel_path, (0, 0))[0]
+            if self.max_total_size:
+                if total + size > self.max_total_size:
+                    continue
+                total += size
+            if self.max_file_size and size > self.max_file_size:
+                continue
+            if rel_path in self.blocks:
+                info = self.blocks[rel_path]
+                if info is None:
+                    continue
+                render = not self.dedup and rel_path not in self.fresh and (prev is None or info[2] is None)
+            else:
+                render = True
+            if render:
+                records.append(FileRecord(os.path.join(self.root, rel_path), rel_path))
+            plan.append((rel_path, render))
+        rendered = iter_rendered_blocks(records, self.jobs, self.render)
+        deduper = BlockDeduper() if self.dedup else None
+        located = {}
+        count = 0
+        try:
+            with atomic_open(self.output_file) as out:
+                offset = write_block(out, f"## Project Structure\n```text\n{tree_str}\n```\n\n## Code Contents\n\n")
+                for rel_path, render in plan:
+                    block = self.fresh.get(rel_path)
+                    if render:
+                        _, block, error = next(rendered)
+                        if error is not None:
+                            log(f"跳过文件 {rel_path}: {error}")
+                        self.blocks[rel_path] = None if block is None else [block_digest(block), len(block), None, 0]
+                        if block is None:
+                            continue
+                    info = self.blocks[rel_path]
+                    if deduper is not None:
+                        source = deduper.source(rel_path, info[0])
+                        ref = None if source is None else deduper.ref(rel_path, source, info[1])
+                        if ref is not None:
+                            offset += write_block(out, ref)
+                            count += 1
+                            continue
+                    if block is None and (prev is None or info[2] is None):
+                        block = self._render_one(rel_path)
+                        if block is None:
+                            continue
+                    if block is not None:
+                        nbytes = write_block(out, block)
+                    else:
+                        nbytes = info[3]
+                        prev.seek(info[2])
+                        out.write(prev.read(nbytes))
+                    located[rel_path] = (offset, nbytes)
+                    offset += nbytes
+                    count += 1
+                out.flush()
+                st = os.fstat(out.fileno())
+                # Windows 上打开着的文件不能被 rename 覆盖
+                if prev is not None:
+                    prev.close()
+        finally:
+            rendered.close()
+            if prev is not None:
+                prev.close()
+        self.output_stat = (st.st_size, st.st_mtime_ns, st.st_ino)
+        for rel_path, info in self.blocks.items():
+            if info is not None:
+                info[2], info[3] = located.get(rel_path, (None, 0))
+        self.fresh.clear()
+        return count
+
+    def _full_scan(self):
+        self._reset()
+        touched = set()
+        if self._walk("", self._root_chain(), touched) is None:
+            raise OSError(f"无法读取目录 {self.root}")
+        # 代码块在 _write 中按输出顺序边渲染边写出，不在内存中积攒
+
+    def _poll(self):
+        """轮询：比较目录与文件的 stat 快照，返回 (变化的文件, 需要重新列出的目录)"""
+        files, dirs = set(), set()
+        while not files and not dirs:
+            time.sleep(self.interval)
+            for prefix, mtime in list(self.dir_mtimes.items()):
+                try:
+                    if os.stat(self._dir_path(prefix)).st_mtime_ns != mtime:
+                        dirs.add(prefix)
+                except OSError:
+                    dirs.add(_parent_prefix(prefix))
+            for rel_path, snapshot in self.files.items():
+                try:
+                    st = os.stat(os.path.join(self.root, rel_path))
+                except OSError:
+                    dirs.add(_parent_prefix(rel_path))
+                    continue
+                if (st.st_size, st.st_mtime_ns, st.st_ino) != snapshot:
+                    files.add(rel_path)
+        return files, dirs, False
+
+    def _wait_events(self):
+        """inotify：阻塞到有事件为止，返回 (变化的文件, 需要重新列出的目录, 是否需要完整遍历)"""
+        files, dirs, full = set(), set(), False
+        while not files and not dirs and not full:
+            events = self.inotify.read()
+            while True:
+                more = self.inotify.read(self.DEBOUNCE)
+                if not more:
+                    break
+                events.extend(more)
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    full = True
+                    continue
+                prefix = self.wds.get(wd)
+                if prefix is None:
+                    continue
+                if mask & IN_IGNORED:
+                    # 目录已删除或被移走，内核已自动移除该监视
+                    del self.wds[wd]
+                elif mask & _IN_STRUCTURE:
+                    dirs.add(prefix)
+                elif name and self._wanted(prefix + name):
+                    files.add(prefix + name)
+        return files, dirs, full
+
+    def run(self):
+        log("正在扫描目录...")
+        self._full_scan()
+        count = self._write()
+        log(f"已导出 {count} 个文件到 {os.path.abspath(self.output_file)}，开始监视变化 (Ctrl+C 结束)")
+        ignore_names = IGNORE_FILE_NAMES + (PROJECT_IGNORE_FILE,)
+        while True:
+            files, dirs, full = self._wait_events() if self.inotify is not None else self._poll()
+            touched = set(files)
+            structure = False
+            for prefix in sorted(dirs, key=len):
+                structure = self._rescan_dir(prefix, touched) or structure
+            if self.use_ignore and any(p.rsplit("/", 1)[-1] in ignore_names for p in touched):
+                full = True
+            start = time.perf_counter()
+            if full:
+                log("忽略规则变化，重新遍历目录")
+                self._full_scan()
+            else:
+                changed = self._render(touched)
+            if full or changed or structure:
+                count = self._write()
+                log(f"已更新 {count if full else changed} 个代码块 ({time.perf_counter() - start:.3f}s)")
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+def watch_export(source_dir, output_file, jobs=1, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE,
+                 cache_verify=False, max_file_size=0, max_total_size=0, use_ignore=True, dedup=False,
+                 interval=1.0):
+    """--watch：先完整导出，之后持续把源目录的变化同步到输出文件，Ctrl+C 结束"""
+    if not os.path.isdir(source_dir):
+        print(f"错误: 目录不存在 {source_dir}", file=sys.stderr)
         sys.exit(1)
-        
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-        print(f"创建目标目录: {target_dir}")
+    cache = ExportCache(cache_dir, source_dir, cache_size, cache_verify) if cache_dir else None
+    watcher = ExportWatcher(source_dir, output_file, jobs, cache, use_ignore,
+                            max_file_size, max_total_size, dedup, interval)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        log("\n已停止监视")
+    finally:
+        watcher.close()
+        if cache is not None:
+            cache.close()
 
-    with open(md_file, "r", encoding="utf-8") as f:
-        full_text = f.read()
+def iter_input_lines(md_file):
+    """
+    逐行读取 Markdown 输入（"-" 表示 stdin），产出去掉换行符的行
+    使用 readline 而非整体读取：管道中每到达一行即可处理
+    """
+    if md_file == "-":
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+        try:
+            for line in iter(stream.readline, ""):
+                yield line[:-1] if line.endswith("\n") else line
+        finally:
+            stream.detach()
+    else:
+        with open(md_file, "r", encoding="utf-8") as f:
+            for line in iter(f.readline, ""):
+                yield line[:-1] if line.endswith("\n") else line
 
-    lines = full_text.split('\n')
-    
+def _natural_key(path):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+def expand_input_paths(md_file):
+    """
+    解析还原输入："-" 表示 stdin；路径不存在且包含通配符时按 glob 展开，
+    多个分片按自然顺序排列，作为一个逻辑输入流处理
+    """
+    if md_file == "-" or os.path.exists(md_file):
+        return [md_file]
+    if glob.has_magic(md_file):
+        return sorted(glob.glob(md_file), key=_natural_key)
+    return []
+
+def iter_markdown_blocks(lines):
+    """
+    状态机解析：逐行消费输入，每遇到闭合栅栏即产出 (相对路径, 文件内容, 语言标记)
+    严格匹配栅栏长度，防止嵌套截断；内存只与当前代码块大小相关
+    """
     # 状态枚举
     STATE_OUTSIDE = 0
     STATE_EXPECT_PATH = 1
@@ -119,11 +2017,9 @@ def restore_from_markdown(md_file, target_dir):
     
     current_state = STATE_OUTSIDE
     current_fence = ""
+    current_lang = ""
     current_path = ""
     code_buffer = []
-    success_count = 0
-    
-    print("开始解析还原...")
 
     for line in lines:
         stripped = line.strip()
@@ -134,9 +2030,10 @@ def restore_from_markdown(md_file, target_dir):
             if stripped.startswith("```"):
                 # 简单分离栅栏和语言标记
                 # 找到第一个非 ` 字符的位置
-                match = re.match(r'^(`+)', stripped)
+                match = re.match(r'^(`+)(.*)', stripped)
                 if match:
                     current_fence = match.group(1)
+                    current_lang = match.group(2).strip()
                     current_state = STATE_EXPECT_PATH
                     code_buffer = []
         
@@ -158,20 +2055,7 @@ def restore_from_markdown(md_file, target_dir):
         # 3. 读取内容直到遇到闭合栅栏
         elif current_state == STATE_INSIDE:
             if line.rstrip() == current_fence:
-                # 写入文件
-                full_path = os.path.join(target_dir, current_path)
-                dir_name = os.path.dirname(full_path)
-                
-                if dir_name and not os.path.exists(dir_name):
-                    os.makedirs(dir_name, exist_ok=True)
-                
-                try:
-                    with open(full_path, "w", encoding="utf-8") as f:
-                        f.write("\n".join(code_buffer))
-                    print(f"已还原: {current_path}")
-                    success_count += 1
-                except Exception as e:
-                    print(f"写入失败 {current_path}: {e}")
+                yield current_path, "\n".join(code_buffer), current_lang
                 
                 # 重置
                 current_state = STATE_OUTSIDE
@@ -181,7 +2065,671 @@ def restore_from_markdown(md_file, target_dir):
             else:
                 code_buffer.append(line)
 
-    print(f"\n还原完成! 共还原 {success_count} 个文件到 {target_dir}")
+# 块索引：记录每个代码块的路径、语言标记、栅栏与正文字节范围，选择性还原时直接定位到所需的代码块
+INDEX_FORMAT = "cli-index-1"
+INDEX_SUFFIX = ".idx.json"
+
+def index_path(md_file):
+    return md_file + INDEX_SUFFIX
+
+def index_entry(block, offset, nbytes):
+    """
+    由 write_block 写在 offset 处、共 nbytes 字节的代码块生成索引项
+    [路径, 语言标记, 栅栏, 正文起始字节, 正文结束字节]
+    """
+    if isinstance(block, ByteBlock):
+        head = block.head.decode("utf-8")
+        head_bytes = len(block.head)
+    else:
+        head = block[:block.index("\n", block.index("\n") + 1) + 1]
+        head_bytes = len(encode_for_disk(head))
+    fence_line, path_line = head.split("\n")[:2]
+    lang = fence_line.lstrip("`")
+    fence = fence_line[:len(fence_line) - len(lang)]
+    # 正文之后是 "\n栅栏\n\n"
+    tail_bytes = len(fence) + 3 * len(os.linesep)
+    return [path_line.lstrip("#").strip(), lang.strip(), fence, offset + head_bytes, offset + nbytes - tail_bytes]
+
+def save_block_index(md_file, entries):
+    """写入块索引；记录 Markdown 文件的大小与 mtime，文件被修改后索引自动失效"""
+    st = os.stat(md_file)
+    data = {"format": INDEX_FORMAT, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "blocks": entries}
+    path = index_path(md_file)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def load_block_index(md_file):
+    """读取与 md_file 匹配的块索引；不存在、格式不符或已过期时返回 None"""
+    try:
+        with open(index_path(md_file), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        st = os.stat(md_file)
+    except (OSError, ValueError):
+        return None
+    if (data.get("format") != INDEX_FORMAT or data.get("size") != st.st_size
+            or data.get("mtime_ns") != st.st_mtime_ns):
+        return None
+    return data["blocks"]
+
+def scan_block_index(md_file):
+    """
+    预扫描生成块索引：与 iter_markdown_blocks 相同的状态机，但在 mmap 的字节上进行；
+    代码块内部不逐行处理，直接搜索 "\n栅栏" 定位闭合行，只记录范围、不复制内容
+    """
+    entries = []
+    with open(md_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return entries
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with data:
+        size = len(data)
+
+        def line_end(pos):
+            end = data.find(b"\n", pos)
+            return size if end == -1 else end
+
+        pos = 0
+        while pos < size:
+            end = line_end(pos)
+            stripped = data[pos:end].strip()
+            pos = end + 1
+            if not stripped.startswith(b"```") or pos >= size:
+                continue
+            lang = stripped.lstrip(b"`")
+            fence = stripped[:len(stripped) - len(lang)]
+
+            # 路径注释必须紧跟栅栏行，否则连同该行一起丢弃
+            end = line_end(pos)
+            path_line = data[pos:end].strip()
+            pos = end + 1
+            if not path_line.startswith(b"#"):
+                continue
+
+            # 闭合行：行首为同样长度的栅栏，其后只有空白
+            probe = end
+            while True:
+                hit = data.find(b"\n" + fence, probe)
+                if hit == -1:
+                    # 未闭合的代码块与其后的内容都不会被还原
+                    return entries
+                close_end = line_end(hit + 1)
+                if data[hit + 1:close_end].rstrip() == fence:
+                    break
+                probe = hit + 1
+            content_end = max(hit, pos)
+            if content_end > pos and data[content_end - 1] == 0x0D:
+                content_end -= 1  # CRLF 换行
+            entries.append([path_line.decode("utf-8").lstrip("#").strip(), lang.decode("utf-8").strip(),
+                            fence.decode("ascii"), pos, content_end])
+            pos = close_end + 1
+    return entries
+
+def get_block_index(md_file):
+    """优先使用导出时生成的块索引，没有可用索引时预扫描"""
+    entries = load_block_index(md_file)
+    if entries is None:
+        print(f"未找到可用的块索引，预扫描 {md_file} ...", file=sys.stderr, flush=True)
+        entries = scan_block_index(md_file)
+    return entries
+
+def read_block_content(f, entry):
+    """按索引项从二进制文件中读取代码块正文，结果与 iter_markdown_blocks 解析出的内容相同"""
+    f.seek(entry[3])
+    content = f.read(entry[4] - entry[3]).decode("utf-8")
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+def path_matches(rel_path, patterns):
+    """--only 的匹配规则：fnmatch 通配符 (* 可以跨越 /)，任一模式匹配即可"""
+    return any(fnmatch.fnmatchcase(rel_path, pattern) for pattern in patterns)
+
+def iter_indexed_blocks(md_files, patterns=None, stats=None):
+    """
+    借助块索引只读取需要的代码块，产出 (相对路径, 文件内容, 语言标记)；patterns 为空时产出全部代码块
+    引用块所引用的文件未被选中时，改为读取被引用文件的内容直接写出；删除列表只保留匹配的路径
+    读取量只与选中的代码块大小相关，与文档总大小无关 (没有索引时需要一次预扫描)
+    """
+    sources = {}  # 相对路径 -> (输入文件, 索引项)，用于解析引用块
+    for md_file in md_files:
+        entries = get_block_index(md_file)
+        with open(md_file, "rb") as f:
+            for entry in entries:
+                rel_path, lang = entry[0], entry[1]
+                if lang == DELETE_LANG:
+                    deleted = [line.strip() for line in read_block_content(f, entry).split("\n")]
+                    deleted = [p for p in deleted if p and (not patterns or path_matches(p, patterns))]
+                    if deleted:
+                        yield rel_path, "\n".join(deleted), lang
+                    continue
+                if lang != REF_LANG:
+                    sources[rel_path] = (md_file, entry)
+                if patterns and not path_matches(rel_path, patterns):
+                    continue
+                if stats is not None:
+                    stats.count("bytes_read", entry[4] - entry[3])
+                content = read_block_content(f, entry)
+                if lang == REF_LANG:
+                    source = sources.get(content.strip())
+                    if source is not None and patterns and not path_matches(content.strip(), patterns):
+                        source_file, source_entry = source
+                        with open(source_file, "rb") as sf:
+                            content = read_block_content(sf, source_entry)
+                        lang = source_entry[1]
+                yield rel_path, content, lang
+
+def list_markdown_blocks(md_file, patterns=None):
+    """--list：按块索引列出代码块 (正文字节数与路径)，不读取文件内容"""
+    md_files = expand_input_paths(md_file)
+    if not md_files or "-" in md_files:
+        print(f"错误: --list 需要可随机读取的 MD 文件 {md_file}", file=sys.stderr)
+        sys.exit(1)
+    count = 0
+    for md_file in md_files:
+        entries = get_block_index(md_file)
+        with open(md_file, "rb") as f:
+            for rel_path, lang, _, start, end in entries:
+                if lang == DELETE_LANG:
+                    for deleted in read_block_content(f, [rel_path, lang, None, start, end]).split("\n"):
+                        deleted = deleted.strip()
+                        if deleted and (not patterns or path_matches(deleted, patterns)):
+                            print(f"{'deleted':>10}  {deleted}")
+                    continue
+                if patterns and not path_matches(rel_path, patterns):
+                    continue
+                if lang == REF_LANG:
+                    source = read_block_content(f, [rel_path, lang, None, start, end]).strip()
+                    print(f"{'ref':>10}  {rel_path} -> {source}")
+                else:
+                    print(f"{end - start:>10}  {rel_path}")
+                count += 1
+    print(f"共 {count} 个文件", file=sys.stderr)
+
+# 还原结果状态
+WRITE_NEW = "new"
+WRITE_UPDATED = "written"
+WRITE_UNCHANGED = "unchanged"
+WRITE_DELETED = "deleted"
+
+def encode_for_disk(content):
+    """与文本模式写入等价：换行符转换为平台换行后按 UTF-8 编码"""
+    if os.linesep != "\n":
+        content = content.replace("\n", os.linesep)
+    return content.encode("utf-8")
+
+def _file_digest(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.digest()
+
+_umask = None
+
+def _new_file_mode():
+    """新文件的默认权限 (0666 & ~umask)，与 open() 创建的文件一致"""
+    global _umask
+    if _umask is None:
+        _umask = os.umask(0)
+        os.umask(_umask)
+    return 0o666 & ~_umask
+
+@contextlib.contextmanager
+def atomic_open(full_path, mode=None):
+    """
+    先写同目录临时文件再 rename 覆盖，避免中途失败留下半截文件
+    产出临时文件的二进制流，with 块正常结束才覆盖目标，异常时删除临时文件
+    """
+    dir_name = os.path.dirname(full_path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=".cm-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.chmod(tmp_path, _new_file_mode() if mode is None else mode)
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def atomic_write(full_path, data, mode=None):
+    """一次性写入 data 的 atomic_open"""
+    with atomic_open(full_path, mode) as f:
+        f.write(data)
+
+def write_if_changed(full_path, data):
+    """
+    内容与磁盘上已有文件一致时跳过写入（先比大小，再比哈希），不改动 mtime
+    返回 WRITE_NEW / WRITE_UPDATED / WRITE_UNCHANGED
+    """
+    try:
+        st = os.stat(full_path)
+    except FileNotFoundError:
+        atomic_write(full_path, data)
+        return WRITE_NEW
+    if st.st_size == len(data) and _file_digest(full_path) == hashlib.sha1(data).digest():
+        return WRITE_UNCHANGED
+    atomic_write(full_path, data, stat.S_IMODE(st.st_mode))
+    return WRITE_UPDATED
+
+# 引用块的还原方式
+LINK_COPY = "copy"
+LINK_HARD = "hardlink"
+LINK_REFLINK = "reflink"
+# Linux FICLONE ioctl：在 btrfs / xfs 等文件系统上创建共享数据块的写时复制副本
+_FICLONE = 0x40049409
+
+def safe_rel_path(rel_path):
+    """引用块与删除列表中的路径必须位于还原目录内：拒绝绝对路径与向上跳出的路径"""
+    norm = os.path.normpath(rel_path)
+    if os.path.isabs(norm) or norm.split(os.sep)[0] == "..":
+        raise ValueError(f"不安全的路径: {rel_path}")
+    return norm
+
+def _replace_with(full_path, make):
+    """make(临时路径) 在同目录生成临时文件后 rename 覆盖目标"""
+    tmp_path = os.path.join(os.path.dirname(full_path) or ".",
+                            f".cm-{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        make(tmp_path)
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _reflink(src_path, tmp_path):
+    import fcntl
+    with open(src_path, "rb") as src:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, _new_file_mode())
+        with os.fdopen(fd, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+def link_if_changed(src_path, full_path, link_mode=LINK_COPY):
+    """
+    把已还原的 src_path 物化为 full_path：copy 复制内容，hardlink 创建硬链接，reflink 创建写时复制副本
+    链接失败 (文件系统不支持、跨设备、非 Linux 等) 时退回复制；返回值同 write_if_changed
+    注意硬链接的两个路径共享同一份数据，修改其中一个会影响另一个
+    """
+    try:
+        st = os.stat(full_path)
+    except FileNotFoundError:
+        st = None
+    if link_mode == LINK_HARD:
+        src_st = os.stat(src_path)
+        if st is not None and os.path.samestat(st, src_st):
+            return WRITE_UNCHANGED
+        try:
+            _replace_with(full_path, lambda tmp_path: os.link(src_path, tmp_path))
+            return WRITE_NEW if st is None else WRITE_UPDATED
+        except OSError:
+            pass
+    elif link_mode == LINK_REFLINK:
+        if st is not None and st.st_size == os.stat(src_path).st_size and _file_digest(full_path) == _file_digest(src_path):
+            return WRITE_UNCHANGED
+        try:
+            _replace_with(full_path, lambda tmp_path: _reflink(src_path, tmp_path))
+            return WRITE_NEW if st is None else WRITE_UPDATED
+        except (OSError, ImportError):
+            pass
+    with open(src_path, "rb") as f:
+        return write_if_changed(full_path, f.read())
+
+class RestoreWriter:
+    """
+    还原写入器：jobs > 1 时把解析出的代码块交给写线程池，解析线程只负责读取输入
+    记住已创建过的目录，避免每个文件都 exists/makedirs；写入失败统一收集，结束时汇总报告
+    引用块 (submit_ref) 等源文件落盘后按 link_mode 复制 / 硬链接 / reflink
+    删除列表 (submit_delete) 只删除还原目录内的普通文件，并清理因此变空的目录
+    """
+
+    def __init__(self, target_dir, jobs=1, stats=None, link_mode=LINK_COPY):
+        self.target_dir = target_dir
+        self.stats = stats
+        self.link_mode = link_mode
+        self.counts = {WRITE_NEW: 0, WRITE_UPDATED: 0, WRITE_UNCHANGED: 0, WRITE_DELETED: 0}
+        self.failures = []
+        self._made_dirs = set()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        # 限制在途代码块数量，内存仍然有界
+        self._slots = threading.BoundedSemaphore(jobs * 4) if jobs > 1 else None
+
+    def submit(self, rel_path, content):
+        self._schedule(rel_path, (), self._write, rel_path, content)
+
+    def submit_ref(self, rel_path, source_path):
+        self._schedule(rel_path, (source_path,), self._link, rel_path, source_path)
+
+    def submit_delete(self, rel_path):
+        # 删除会清理空目录，与并发写入交错时可能删掉正要写入的目录：先等在途写入全部完成
+        with self._lock:
+            futures = list(self._inflight.values())
+        for future in futures:
+            future.result()
+        self._delete(rel_path)
+
+    def _schedule(self, rel_path, depends, func, *args):
+        if self._pool is None:
+            func(*args)
+            return
+        # 同一路径出现多次时必须按文档顺序落盘：等待前一次写入完成；引用块还要等源文件写完
+        for path in (rel_path,) + depends:
+            previous = self._inflight.get(path)
+            if previous is not None:
+                previous.result()
+        self._slots.acquire()
+        future = self._pool.submit(func, *args)
+        self._inflight[rel_path] = future
+        future.add_done_callback(lambda f: self._done(rel_path, f))
+
+    def _done(self, rel_path, future):
+        with self._lock:
+            if self._inflight.get(rel_path) is future:
+                del self._inflight[rel_path]
+        self._slots.release()
+
+    def _ensure_dir(self, dir_name):
+        if not dir_name or dir_name in self._made_dirs:
+            return
+        os.makedirs(dir_name, exist_ok=True)
+        with self._lock:
+            self._made_dirs.add(dir_name)
+
+    def _write(self, rel_path, content):
+        full_path = os.path.join(self.target_dir, rel_path)
+        stats = self.stats
+        try:
+            if stats is None:
+                self._ensure_dir(os.path.dirname(full_path))
+                result = write_if_changed(full_path, encode_for_disk(content))
+            else:
+                t0 = time.perf_counter()
+                data = encode_for_disk(content)
+                t1 = time.perf_counter()
+                self._ensure_dir(os.path.dirname(full_path))
+                result = write_if_changed(full_path, data)
+                t2 = time.perf_counter()
+                stats.add("encode", t1 - t0)
+                stats.add("write", t2 - t1)
+                if result != WRITE_UNCHANGED:
+                    stats.count("bytes_written", len(data))
+                stats.file_done(rel_path, t2 - t0)
+        except Exception as e:
+            self._fail(rel_path, e)
+            return
+        self._done_file(rel_path, result)
+
+    def _link(self, rel_path, source_path):
+        full_path = os.path.join(self.target_dir, rel_path)
+        stats = self.stats
+        try:
+            src_path = os.path.join(self.target_dir, safe_rel_path(source_path))
+            if not os.path.isfile(src_path):
+                raise FileNotFoundError(f"引用的源文件不存在: {source_path}")
+            t0 = time.perf_counter()
+            self._ensure_dir(os.path.dirname(full_path))
+            result = link_if_changed(src_path, full_path, self.link_mode)
+            if stats is not None:
+                elapsed = time.perf_counter() - t0
+                stats.add("write", elapsed)
+                stats.file_done(rel_path, elapsed)
+        except Exception as e:
+            self._fail(rel_path, e)
+            return
+        self._done_file(rel_path, result)
+
+    def _delete(self, rel_path):
+        try:
+            full_path = os.path.join(self.target_dir, safe_rel_path(rel_path))
+            try:
+                st = os.lstat(full_path)
+            except FileNotFoundError:
+                return
+            if not stat.S_ISREG(st.st_mode):
+                raise ValueError("不是普通文件，未删除")
+            os.unlink(full_path)
+            # 向上清理变空的目录，直到还原目录为止
+            root = os.path.abspath(self.target_dir)
+            dir_name = os.path.dirname(os.path.abspath(full_path))
+            while dir_name != root and dir_name.startswith(root + os.sep):
+                try:
+                    os.rmdir(dir_name)
+                except OSError:
+                    break
+                with self._lock:
+                    self._made_dirs.discard(os.path.join(self.target_dir, os.path.relpath(dir_name, root)))
+                dir_name = os.path.dirname(dir_name)
+        except Exception as e:
+            self._fail(rel_path, e)
+            return
+        with self._lock:
+            self.counts[WRITE_DELETED] += 1
+        print(f"已删除: {rel_path}", flush=True)
+
+    def _fail(self, rel_path, error):
+        with self._lock:
+            self.failures.append((rel_path, error))
+        if self.stats is not None:
+            self.stats.skip(type(error).__name__)
+
+    def _done_file(self, rel_path, result):
+        with self._lock:
+            self.counts[result] += 1
+        if result != WRITE_UNCHANGED:
+            print(f"已还原: {rel_path}", flush=True)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+class ArchiveWriter:
+    """
+    把还原结果直接写入 zip / tar 归档 (接口同 RestoreWriter)，不在磁盘上展开
+    zip 使用 deflate 压缩；tar 按后缀选择 gz / bz2 / xz 压缩
+    内容统一为 UTF-8 + LF 换行，与平台无关；先写入临时文件，完成后再 rename 为目标文件
+    归档只能顺序写入，jobs 参数不生效；同一路径多次出现时按顺序追加，解压时以最后一次为准 (与目录还原一致)
+    引用块在 tar 中总是写为硬链接成员，在 zip 中总是复制内容
+    """
+
+    def __init__(self, archive_path, stats=None):
+        self.archive_path = archive_path
+        self.stats = stats
+        self.counts = {WRITE_NEW: 0, WRITE_UPDATED: 0, WRITE_UNCHANGED: 0}
+        self.failures = []
+        self._seen = set()
+        self._mtime = time.time()
+        self._tmp_path = archive_path + ".tmp"
+        lower = archive_path.lower()
+        if lower.endswith(".zip"):
+            self._zip = zipfile.ZipFile(self._tmp_path, "w", zipfile.ZIP_DEFLATED)
+            self._tar = None
+        else:
+            if lower.endswith((".tar.gz", ".tgz")):
+                mode = "w:gz"
+            elif lower.endswith((".tar.bz2", ".tbz2")):
+                mode = "w:bz2"
+            elif lower.endswith((".tar.xz", ".txz")):
+                mode = "w:xz"
+            else:
+                mode = "w"
+            self._zip = None
+            self._tar = tarfile.open(self._tmp_path, mode, format=tarfile.PAX_FORMAT)
+
+    def submit(self, rel_path, content):
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        data = content.encode("utf-8")
+        if stats is not None:
+            stats.add("encode", time.perf_counter() - t0)
+        self._add(rel_path, data)
+
+    def submit_ref(self, rel_path, source_path):
+        """引用块：tar 写入硬链接成员；zip 不支持链接，从正在写入的归档中读回源文件再写一份"""
+        source = source_path.replace("\\", "/")
+        if source not in self._seen:
+            self._fail(rel_path, FileNotFoundError(f"引用的源文件不存在: {source_path}"))
+            return
+        if self._tar is not None:
+            self._add(rel_path, None, source)
+            return
+        try:
+            data = self._zip.read(source)
+        except Exception as e:
+            self._fail(rel_path, e)
+            return
+        self._add(rel_path, data)
+
+    def submit_delete(self, rel_path):
+        # 归档是新建的，其中不存在需要删除的旧文件
+        print(f"归档输出忽略删除列表中的路径: {rel_path}", flush=True)
+
+    def _add(self, rel_path, data, link_to=None):
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        name = rel_path.replace("\\", "/")
+        try:
+            if self._zip is not None:
+                info = zipfile.ZipInfo(name, time.localtime(self._mtime)[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o100644 << 16
+                with warnings.catch_warnings():
+                    # 重复路径已由下面的提示说明，不需要 zipfile 再警告
+                    warnings.simplefilter("ignore")
+                    self._zip.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(name)
+                info.mtime = self._mtime
+                info.mode = 0o644
+                if link_to is None:
+                    info.size = len(data)
+                    self._tar.addfile(info, io.BytesIO(data))
+                else:
+                    info.type = tarfile.LNKTYPE
+                    info.linkname = link_to
+                    self._tar.addfile(info)
+        except Exception as e:
+            self._fail(rel_path, e)
+            return
+        if name in self._seen:
+            print(f"警告: 路径重复出现，归档中以最后一次为准: {rel_path}", flush=True)
+            self.counts[WRITE_UPDATED] += 1
+        else:
+            self._seen.add(name)
+            self.counts[WRITE_NEW] += 1
+        if stats is not None:
+            elapsed = time.perf_counter() - t0
+            stats.add("write", elapsed)
+            if data is not None:
+                stats.count("bytes_written", len(data))
+            stats.file_done(rel_path, elapsed)
+        print(f"已还原: {rel_path}", flush=True)
+
+    def _fail(self, rel_path, error):
+        self.failures.append((rel_path, error))
+        if self.stats is not None:
+            self.stats.skip(type(error).__name__)
+
+    def close(self):
+        """完成写入：关闭临时归档并替换目标文件"""
+        archive = self._zip if self._zip is not None else self._tar
+        archive.close()
+        os.replace(self._tmp_path, self.archive_path)
+
+    def abort(self):
+        """还原中途失败：丢弃临时归档，目标文件保持原样"""
+        archive = self._zip if self._zip is not None else self._tar
+        try:
+            archive.close()
+        finally:
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+
+def restore_from_markdown(md_file, target_dir, jobs=1, stats=None, link_mode=LINK_COPY, only=None):
+    """
+    还原模式：流式解析 Markdown 写入文件
+    md_file 为 "-" 时从 stdin 读取，每个代码块闭合后立即落盘，
+    可直接把大模型的流式输出管道给本工具；也可传入分片通配符 (如 "project.part*.md")
+    内容未变化的文件不会重写；变化的文件通过临时文件 + rename 原子替换
+    jobs > 1 时由写线程池并发落盘，适合网络存储等系统调用开销大的场景
+    target_dir 以 .zip / .tar / .tar.gz 等结尾时直接写入归档 (见 ArchiveWriter)
+    引用块 (--dedup 导出) 按 link_mode 复制 / 硬链接 / reflink 所引用的文件
+    删除列表块 (--since 增量导出) 中的路径会从目标目录删除
+    only 为通配符列表时只还原路径匹配的文件：借助块索引直接读取对应的代码块，不解析整个文档
+    stats 为 Stats 实例时记录解析/编码/写入耗时与计数
+    """
+    md_files = expand_input_paths(md_file)
+    if not md_files:
+        print(f"错误: MD文件不存在 {md_file}")
+        sys.exit(1)
+    if only and "-" in md_files:
+        print("错误: --only 需要可随机读取的 MD 文件，不支持从 stdin 读取", file=sys.stderr)
+        sys.exit(1)
+
+    to_archive = is_archive_path(target_dir) and not os.path.isdir(target_dir)
+    make_dir = os.path.dirname(os.path.abspath(target_dir)) if to_archive else target_dir
+    if not os.path.exists(make_dir):
+        os.makedirs(make_dir)
+        print(f"创建目标目录: {make_dir}")
+
+    print("开始解析还原...", flush=True)
+
+    writer = ArchiveWriter(target_dir, stats) if to_archive else RestoreWriter(target_dir, jobs, stats, link_mode)
+    try:
+        if only:
+            blocks = iter_indexed_blocks(md_files, only, stats)
+        else:
+            lines = itertools.chain.from_iterable(iter_input_lines(path) for path in md_files)
+            blocks = iter_markdown_blocks(lines)
+            if stats is not None:
+                stats.count("bytes_read", sum(os.path.getsize(path) for path in md_files if path != "-"))
+        if stats is not None:
+            # 读取输入与状态机解析交织进行，一并计入 parse
+            blocks = stats.timed_iter("parse", blocks)
+        for current_path, content, lang in blocks:
+            if lang == REF_LANG:
+                writer.submit_ref(current_path, content.strip())
+            elif lang == DELETE_LANG:
+                for rel_path in content.split("\n"):
+                    if rel_path.strip():
+                        writer.submit_delete(rel_path.strip())
+            else:
+                writer.submit(current_path, content)
+    except BaseException:
+        if to_archive:
+            # 不能用不完整的归档覆盖已有的目标文件
+            writer.abort()
+        else:
+            writer.close()
+        raise
+    writer.close()
+
+    counts = writer.counts
+    total = counts[WRITE_NEW] + counts[WRITE_UPDATED] + counts[WRITE_UNCHANGED]
+    print(f"\n还原完成! 共还原 {total} 个文件到 {target_dir}")
+    print(f"新建 {counts[WRITE_NEW]} 个, 更新 {counts[WRITE_UPDATED]} 个, 未变化 {counts[WRITE_UNCHANGED]} 个")
+    if counts.get(WRITE_DELETED):
+        print(f"删除 {counts[WRITE_DELETED]} 个")
+    if writer.failures:
+        print(f"写入失败 {len(writer.failures)} 个:")
+        for rel_path, error in writer.failures:
+            print(f"  {rel_path}: {error}")
+    if stats is not None:
+        stats.count("files", total)
+        for result, n in counts.items():
+            stats.count(f"files_{result}", n)
+        stats.print_summary()
 
 def main():
     parser = argparse.ArgumentParser(description="Python工程结构互转工具 (CLI版)")
@@ -191,17 +2739,86 @@ def main():
     group.add_argument('-e', '--export', action='store_true', help='导出模式: 目录 -> MD文件')
     group.add_argument('-r', '--restore', action='store_true', help='还原模式: MD文件 -> 目录')
     
-    parser.add_argument('-i', '--input', required=True, help='输入路径 (文件夹 或 MD文件)')
-    parser.add_argument('-o', '--output', required=True, help='输出路径 (MD文件 或 文件夹)')
+    parser.add_argument('-i', '--input', required=True, help='输入路径 (文件夹 或 MD文件; 导出时也可以是 zip/tar 归档; 还原时 "-" 表示从 stdin 读取，也可以是分片通配符)')
+    parser.add_argument('-o', '--output', help='输出路径 (MD文件 或 文件夹; 导出时 "-" 表示写入 stdout; 还原时以 .zip/.tar/.tar.gz 等结尾则写入归档; --list 时不需要)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='并发线程数: 导出时并发读取文件 (输出顺序不受影响)，还原时并发写入文件 (默认 1)')
+    parser.add_argument('--cache', action='store_true', help='启用导出缓存 (默认位于用户缓存目录)')
+    parser.add_argument('--cache-dir', help='导出缓存目录 (指定后自动启用缓存)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024), help='缓存容量上限 MB (默认 512，按最近使用淘汰)')
+    parser.add_argument('--cache-verify', action='store_true', help='mtime 变化时比较内容哈希，内容未变仍复用缓存')
+    parser.add_argument('--max-bytes', type=int, default=0, help='分片导出: 每个分片的字节数上限')
+    parser.add_argument('--max-lines', type=int, default=0, help='分片导出: 每个分片的行数上限')
+    parser.add_argument('--max-tokens', type=int, default=0, help='分片导出: 每个分片的估算 token 上限')
+    parser.add_argument('--max-file-size', type=int, default=0, help='单文件大小上限 KB，超出的文件直接跳过 (默认不限)')
+    parser.add_argument('--max-total-size', type=int, default=0, help='导出内容总大小上限 MB，超出后的文件跳过 (默认不限)')
+    parser.add_argument('--git', choices=[GIT_TRACKED, GIT_ALL], help='从 git 索引获取文件列表而不遍历目录: tracked 仅已跟踪文件; all 另含未跟踪且未被忽略的文件')
+    parser.add_argument('--stats', action='store_true', help='结束时输出各阶段耗时、读写字节数、跳过原因与最慢的文件')
+    parser.add_argument('--stats-json', help='把统计结果以 JSON 写入指定文件 (隐含 --stats)')
+    parser.add_argument('--stats-top', type=int, default=10, help='统计中列出的最慢文件数 (默认 10)')
+    parser.add_argument('--profile', help='用 cProfile 记录主线程并写入指定文件 (python -m pstats 查看)')
+    parser.add_argument('--dedup', action='store_true', help='导出时内容相同的文件只输出一次，之后的副本输出为引用块')
+    parser.add_argument('--since', help='增量导出: 只输出相对基准新增或修改的文件并列出已删除的路径；基准为 --manifest 生成的清单文件或 git 版本')
+    parser.add_argument('--manifest', help='导出时把各文件的内容哈希写入清单文件，供之后的 --since 使用')
+    parser.add_argument('--watch', action='store_true', help='导出后持续监视源目录，只重新渲染变化的文件并更新输出 (Ctrl+C 结束)')
+    parser.add_argument('--watch-interval', type=float, default=1.0, help='无法使用 inotify 时的轮询间隔秒数 (默认 1)')
+    parser.add_argument('--link', choices=[LINK_COPY, LINK_HARD, LINK_REFLINK], default=LINK_COPY,
+                        help='还原引用块的方式: copy 复制 (默认); hardlink 硬链接; reflink 写时复制 (不支持时退回复制)')
+    parser.add_argument('--index', action='store_true', help='导出时在输出文件旁写入块索引 (<输出>.idx.json)，供 --only / --list 直接定位代码块')
+    parser.add_argument('--only', action='append', metavar='GLOB', help='还原时只还原路径匹配通配符的文件 (可多次指定，* 可跨越目录)')
+    parser.add_argument('--list', action='store_true', help='列出 MD 文件中的代码块 (正文字节数与路径)，不还原')
+    parser.add_argument('--no-ignore', action='store_true', help='不读取 .gitignore / .ignore / .codemergerignore 忽略规则')
     
     args = parser.parse_args()
-    
+    if args.list and not args.restore:
+        parser.error("--list 只能与 -r 一起使用")
+    if args.output is None and not args.list:
+        parser.error("需要 -o/--output 参数")
+    if args.watch and (args.output == "-" or args.max_bytes or args.max_lines or args.max_tokens or args.git
+                       or args.since or args.manifest or args.index or args.stats or args.stats_json or args.profile):
+        # 监视模式常驻运行、反复重写输出：这些选项只对一次性导出有意义，静默忽略会让人误以为已生效
+        parser.error("--watch 不支持输出到 stdout、分片导出、--git、--since、--manifest、--index、--stats、--stats-json 与 --profile")
+
+    stats = Stats(args.stats_top) if args.stats or args.stats_json else None
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(args, stats)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"cProfile 结果已写入 {os.path.abspath(args.profile)}", file=sys.stderr)
+    if args.stats_json:
+        report = stats.to_dict()
+        report["mode"] = "export" if args.export else "restore"
+        with open(args.stats_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+def run(args, stats=None):
     if args.export:
         # 导出: Input是目录, Output是文件
-        export_to_markdown(args.input, args.output)
+        cache_dir = args.cache_dir or (default_cache_dir() if args.cache else None)
+        if args.watch:
+            watch_export(args.input, args.output, jobs=args.jobs, cache_dir=cache_dir,
+                         cache_size=args.cache_size * 1024 * 1024, cache_verify=args.cache_verify,
+                         max_file_size=args.max_file_size * 1024, max_total_size=args.max_total_size * 1024 * 1024,
+                         use_ignore=not args.no_ignore, dedup=args.dedup, interval=args.watch_interval)
+            return
+        export_to_markdown(args.input, args.output, jobs=args.jobs, cache_dir=cache_dir,
+                           cache_size=args.cache_size * 1024 * 1024, cache_verify=args.cache_verify,
+                           max_bytes=args.max_bytes, max_lines=args.max_lines, max_tokens=args.max_tokens,
+                           max_file_size=args.max_file_size * 1024, max_total_size=args.max_total_size * 1024 * 1024,
+                           use_ignore=not args.no_ignore, git_mode=args.git, dedup=args.dedup,
+                           since=args.since, manifest_path=args.manifest, build_index=args.index, stats=stats)
+    elif args.list:
+        list_markdown_blocks(args.input, args.only)
     elif args.restore:
         # 还原: Input是文件, Output是目录
-        restore_from_markdown(args.input, args.output)
+        restore_from_markdown(args.input, args.output, jobs=args.jobs, stats=stats, link_mode=args.link,
+                              only=args.only)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file